@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import random
+from http.client import HTTPException
+from urllib.request import urlopen, Request
+from urllib.error import URLError
+from urllib.parse import quote
+
+log = logging.getLogger(__name__)
+
+class Heartbeat:
+    """Periodic server list heartbeat that never blocks the event loop
+
+    Requests run in the default executor with a socket timeout, failures are retried
+    with jittered exponential backoff. Everything in the URL except the player count
+    is encoded once.
+    """
+    def __init__(self, url, name, port, salt, max_players=100, software="MCSnake",
+                 interval=120, timeout=10, retries=3, backoff=2):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Encode individual parameters, not the whole URL
+        self.prefix = f"{url}?name={quote(name)}&port={port}&users="
+        self.suffix = f"&max={max_players}&salt={quote(salt)}&public=true&web=false&software={quote(software)}"
+
+    def build_url(self, users):
+        return f"{self.prefix}{users}{self.suffix}"
+
+    def request(self, url):
+        """Blocking request, only ever called from the executor"""
+        with urlopen(Request(url), timeout=self.timeout) as response:
+            return response.read().decode('utf-8')
+
+    async def send(self, users):
+        """Send one heartbeat, returns the response text or None if every attempt failed"""
+        loop = asyncio.get_running_loop()
+        url = self.build_url(users)
+        for attempt in range(self.retries + 1):
+            try:
+                return await loop.run_in_executor(None, self.request, url)
+            except (URLError, OSError, HTTPException, ValueError) as e:
+                log.warning("Heartbeat failed (attempt %d/%d): %s", attempt + 1, self.retries + 1, e)
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        return None
+
+    async def run(self, get_users):
+        """Send a heartbeat every interval seconds with the current player count"""
+        while True:
+            response = await self.send(get_users())
+            if response is not None:
+                log.info("Heartbeat response: %s", response)
+            # A little jitter keeps restarted servers from beating in lockstep
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
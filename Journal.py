@@ -0,0 +1,190 @@
+import asyncio
+import glob
+import logging
+import os
+import struct
+import time
+from array import array
+
+log = logging.getLogger(__name__)
+
+# Records are little-endian and start with a type byte
+BLOCK_RECORD = struct.Struct('<BHHHBBHI')  # type, x, y, z, old id, new id, player number, unix time
+NAME_RECORD = struct.Struct('<BHB')        # type, player number, name length, then the name
+RECORD_BLOCK = 1
+RECORD_NAME = 2
+SERVER = 0  # Player number of changes made by the server itself
+
+class Journal:
+    """Append-only log of block changes between level saves
+
+    Changes are buffered in memory and written to the current segment file with an
+    fsync from the executor every flush_interval seconds. When a save starts the
+    journal moves on to a new segment; the sealed segments are deleted once the level
+    file holding their changes is on disk, or replayed on the next start if it never
+    got there. Every change of this session is also kept in memory, indexed by player,
+    for undo.
+    """
+    def __init__(self, prefix, flush_interval=1.0):
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.segment = self.segment_path(self.next_segment_number())
+        self.named = set()  # Player numbers with a name record in the current segment
+        self.sealed = []    # Segments waiting for a save to make them redundant
+        self.numbers = {'': SERVER}  # Username -> player number
+        self.names = {SERVER: ''}
+        self.next_number = SERVER + 1  # Above every number in use, replayed segments can have gaps
+        self.history = bytearray()  # Every block record of this session
+        self.by_player = {}  # Player number -> array of offsets into history
+        self.lock = asyncio.Lock()
+        self.flush_task = None
+
+    def segment_path(self, number):
+        return f"{self.prefix}.{number:06d}"
+
+    def segments(self):
+        """Existing segment files, oldest first"""
+        return sorted(path for path in glob.glob(glob.escape(self.prefix) + '.*') if path[len(self.prefix) + 1:].isdigit())
+
+    def next_segment_number(self):
+        existing = self.segments()
+        return int(existing[-1][len(self.prefix) + 1:]) + 1 if existing else 1
+
+    def player_number(self, username):
+        number = self.numbers.get(username)
+        if number is None:
+            number = self.next_number
+            self.next_number += 1
+            self.numbers[username] = number
+            self.names[number] = username
+        if number not in self.named:
+            name = username.encode('ascii', 'ignore')[:255]
+            self.buffer += NAME_RECORD.pack(RECORD_NAME, number, len(name)) + name
+            self.named.add(number)
+        return number
+
+    def remember(self, record, player):
+        offsets = self.by_player.get(player)
+        if offsets is None:
+            offsets = self.by_player[player] = array('I')
+        offsets.append(len(self.history))
+        self.history += record
+
+    def log(self, x, y, z, old_id, new_id, username=''):
+        """Append a block change, it reaches the disk on the next flush"""
+        player = self.player_number(username)
+        record = BLOCK_RECORD.pack(RECORD_BLOCK, x, y, z, old_id, new_id, player, int(time.time()))
+        self.buffer += record
+        self.remember(record, player)
+
+    def log_many(self, changes, username=''):
+        """Append (x, y, z, new id, old id) changes from a bulk edit"""
+        player = self.player_number(username)
+        now = int(time.time())
+        pack = BLOCK_RECORD.pack
+        for x, y, z, new_id, old_id in changes:
+            record = pack(RECORD_BLOCK, x, y, z, old_id, new_id, player, now)
+            self.buffer += record
+            self.remember(record, player)
+
+    def replay(self, level):
+        """Apply the changes of every segment left on disk to a freshly loaded level"""
+        count = 0
+        for path in self.segments():
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                kind = data[offset]
+                if kind == RECORD_BLOCK and offset + BLOCK_RECORD.size <= len(data):
+                    record = data[offset:offset + BLOCK_RECORD.size]
+                    _, x, y, z, old_id, new_id, player, _ = BLOCK_RECORD.unpack(record)
+                    if level.in_bounds(x, y, z):
+                        level.blocks[level.index(x, y, z)] = new_id
+                        level.mark_dirty(y, y + 1)
+                    self.remember(record, player)
+                    self.next_number = max(self.next_number, player + 1)
+                    offset += BLOCK_RECORD.size
+                    count += 1
+                elif kind == RECORD_NAME and offset + NAME_RECORD.size <= len(data):
+                    _, player, length = NAME_RECORD.unpack_from(data, offset)
+                    name = data[offset + NAME_RECORD.size:offset + NAME_RECORD.size + length].decode('ascii', 'ignore')
+                    self.numbers[name] = player
+                    self.names[player] = name
+                    self.next_number = max(self.next_number, player + 1)
+                    offset += NAME_RECORD.size + length
+                else:
+                    break  # Torn write from a crash, the rest of this segment is lost
+            # Replayed changes are only safe once a save has absorbed them
+            self.sealed.append(path)
+        if count:
+            level.touch()
+            log.info("Replayed %d block changes from the journal", count)
+        return count
+
+    def discard(self):
+        """Delete every segment, used when the level they belong to is gone"""
+        for path in self.segments():
+            os.remove(path)
+
+    def write(self, path, data):
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self):
+        """Write buffered records to the current segment from the executor"""
+        async with self.lock:
+            if not self.buffer:
+                return
+            data = self.buffer
+            self.buffer = bytearray()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.write, self.segment, data)
+            except BaseException:
+                # Keep the records for the next flush, ahead of anything logged meanwhile
+                self.buffer = data + self.buffer
+                raise
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                log.error("Error writing journal: %s", e)
+
+    async def begin_save(self):
+        """Seal the current segment, call right before the level snapshot is taken"""
+        await self.flush()
+        self.sealed.append(self.segment)
+        self.segment = self.segment_path(int(self.segment[len(self.prefix) + 1:]) + 1)
+        self.named = set()
+        return list(self.sealed)
+
+    async def end_save(self, sealed):
+        """The level file now holds every change in sealed, delete those segments"""
+        def remove():
+            for path in sealed:
+                if os.path.exists(path):
+                    os.remove(path)
+        await asyncio.get_running_loop().run_in_executor(None, remove)
+        self.sealed = [path for path in self.sealed if path not in sealed]
+
+    def find(self, username, x0, y0, z0, x1, y1, z1):
+        """Changes a player made inside an inclusive box, newest first, as (x, y, z, old id, new id)"""
+        player = self.numbers.get(username)
+        if player is None:
+            return []
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        z0, z1 = min(z0, z1), max(z0, z1)
+        found = []
+        history = self.history
+        for offset in reversed(self.by_player.get(player, ())):
+            _, x, y, z, old_id, new_id, _, _ = BLOCK_RECORD.unpack_from(history, offset)
+            if x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1:
+                found.append((x, y, z, old_id, new_id))
+        return found
@@ -1,34 +1,108 @@
 import gzip
+import zlib
 import struct
 import math
 import json
 import base64
+import mmap
+import os
+import sys
+import functools
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+# Native level file: a fixed little-endian header followed by the raw XZY block bytes,
+# or, when LEVEL_FLAG_COMPRESSED is set, a table of frame lengths and one zlib frame
+# per region of REGION_LAYERS Y-layers.
+LEVEL_MAGIC = b'MCSL'
+LEVEL_FORMAT_VERSION = 1
+LEVEL_FLAG_COMPRESSED = 0x01
+LEVEL_HEADER = struct.Struct('<4sHHHHHhhhBxHI')  # magic, version, flags, width, height, depth, spawn x/y/z, rotSpawn, region layers, region count
+REGION_FRAME = struct.Struct('<I')
+REGION_LAYERS = 16
+
+# Partial save side file: the new header, then (offset, length, data) block ranges,
+# then a CRC32 of everything before it so a torn write is recognised.
+PATCH_RANGE = struct.Struct('<QI')
+PATCH_CRC = struct.Struct('<I')
 
 class Level:
     def __init__(self):
         self.width = 0
         self.height = 0
         self.depth = 0
-        self.blocks = []
+        self.blocks = bytearray()
         self.xSpawn = 0
         self.ySpawn = 0
         self.zSpawn = 0
         self.rotSpawn = 0
+        self.version = 0  # Bumped on every change so cached map snapshots can be invalidated
+        self.dirty_regions = set()  # Regions changed since the last save
+        self.saved_as = None  # Raw native file whose contents match the blocks outside dirty_regions
+
+    def allocate(self, width, height, depth, block_id=0):
+        """Allocate a contiguous block buffer for the given dimensions"""
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.blocks = bytearray([block_id]) * (width * height * depth)
+        self.version += 1
+        self.saved_as = None
+
+    def index(self, x, y, z):
+        """Return the buffer index of a block (XZY order, same as the wire format)"""
+        return x + (z * self.width) + (y * self.width * self.depth)
+
+    def in_bounds(self, x, y, z):
+        return 0 <= x < self.width and 0 <= y < self.height and 0 <= z < self.depth
+
+    def view(self):
+        """Return a zero-copy memoryview of the block buffer"""
+        return memoryview(self.blocks)
+
+    def as_array(self):
+        """Return a zero-copy NumPy view of the blocks indexed as [y, z, x]"""
+        if np is None:
+            raise RuntimeError("NumPy is not installed")
+        return np.frombuffer(self.blocks, dtype=np.uint8).reshape(self.height, self.depth, self.width)
+
+    def fill_layers(self, y_start, y_end, block_id):
+        """Fill every block with y_start <= y < y_end with block_id"""
+        layer = self.width * self.depth
+        y_start = max(0, y_start)
+        y_end = min(self.height, y_end)
+        if y_end <= y_start:
+            return
+        self.blocks[y_start * layer:y_end * layer] = bytes([block_id]) * ((y_end - y_start) * layer)
+        self.touch(y_start, y_end)
+
+    def touch(self, y_start=0, y_end=None):
+        """Record a change made directly to the buffer (e.g. through as_array) between two Y layers"""
+        self.version += 1
+        self.mark_dirty(y_start, self.height if y_end is None else y_end)
+
+    def mark_dirty(self, y_start, y_end):
+        """Mark the regions covering y_start <= y < y_end as needing a save"""
+        self.dirty_regions.update(range(y_start // REGION_LAYERS, (y_end - 1) // REGION_LAYERS + 1))
+
+    def copy(self):
+        """Return a detached copy of the level whose blocks are an immutable snapshot"""
+        level = Level()
+        level.width, level.height, level.depth = self.width, self.height, self.depth
+        level.xSpawn, level.ySpawn, level.zSpawn, level.rotSpawn = self.xSpawn, self.ySpawn, self.zSpawn, self.rotSpawn
+        level.blocks = bytes(self.blocks)
+        level.version = self.version
+        return level
 
     def format_level_data(self):
         """Format level data in XZY order with length prefix"""
-        # Create new array in XZY order
-        xzy_blocks = []
-        for y in range(self.depth):
-            for z in range(self.height):
-                for x in range(self.width):
-                    index = x + (z * self.width) + (y * self.width * self.height)
-                    xzy_blocks.append(self.blocks[index])
-        
-        # Add length prefix (4 bytes, big endian)
-        length = len(xzy_blocks)
-        data = struct.pack('>I', length) + bytes(xzy_blocks)
-        return gzip.compress(data)
+        return compress_blocks(self.blocks)
     
     def parse_level_data(self, compressed_data):
         """Parse level data from XZY order with length prefix"""
@@ -37,16 +111,13 @@ class Level:
         
         # Extract the length prefix (first 4 bytes, big endian)
         length = struct.unpack('>I', decompressed_data[:4])[0]
-        xzy_blocks = decompressed_data[4:4 + length]
-        
-        # Convert XZY order back to original order
-        self.blocks = [0] * (self.width * self.height * self.depth)
-        for y in range(self.depth):
-            for z in range(self.height):
-                for x in range(self.width):
-                    index = x + (z * self.width) + (y * self.width * self.height)
-                    xzy_index = (y * self.height * self.width) + (z * self.width) + x
-                    self.blocks[index] = xzy_blocks[xzy_index]
+        self.blocks = bytearray(decompressed_data[4:4 + length])
+
+        expected = self.width * self.height * self.depth
+        if len(self.blocks) < expected:
+            self.blocks.extend(bytes(expected - len(self.blocks)))
+        self.version += 1
+        self.saved_as = None
 
     def get_chunks(self, compressed_data):
         """Split compressed data into 1024 byte chunks"""
@@ -75,13 +146,86 @@ class Level:
     def modify_block(self, x, y, z, block_id):
         """Modify a block at given coordinates"""
         if 0 <= x < self.width and 0 <= y < self.height and 0 <= z < self.depth:
-            index = x + (z * self.width) + (y * self.width * self.depth)
-            self.blocks[index] = block_id
+            self.blocks[x + (z * self.width) + (y * self.width * self.depth)] = block_id
+            self.version += 1
+            self.dirty_regions.add(y // REGION_LAYERS)
         else:
-            print(f"Coordinates ({x}, {y}, {z}) are out of bounds for the level size ({self.width}, {self.height}, {self.depth})")
+            log.debug("Coordinates (%d, %d, %d) are out of bounds for the level size (%d, %d, %d)", x, y, z, self.width, self.height, self.depth)
+
+    def get_block(self, x, y, z):
+        """Get the block at given coordinates, AIR if out of bounds"""
+        if 0 <= x < self.width and 0 <= y < self.height and 0 <= z < self.depth:
+            return self.blocks[x + (z * self.width) + (y * self.width * self.depth)]
+        return Blocks.AIR
+
+    def region_count(self):
+        """Number of REGION_LAYERS-high regions the level is split into"""
+        return max(1, -(-self.height // REGION_LAYERS))
+
+    def region_bounds(self, region):
+        """Return the (start, end) buffer offsets of a region"""
+        layer = self.width * self.depth
+        start = region * REGION_LAYERS * layer
+        return start, min(len(self.blocks), start + REGION_LAYERS * layer)
+
+    def save_level(self, filename, compress=False):
+        """Save the level to a file in the native format, atomically replacing it"""
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            self.write_level(f, compress)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+        discard_patch(filename)  # Left by a failed partial save, older than this file
+        self.dirty_regions.clear()
+        self.saved_as = None if compress else filename
+        log.info("Level saved to %s", filename)
+
+    def pack_header(self, compress=False):
+        return LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_FORMAT_VERSION, LEVEL_FLAG_COMPRESSED if compress else 0,
+                                 self.width, self.height, self.depth,
+                                 self.xSpawn, self.ySpawn, self.zSpawn, self.rotSpawn,
+                                 REGION_LAYERS, self.region_count())
+
+    def write_level(self, f, compress=False):
+        """Write the native header and block data to an open binary file"""
+        regions = self.region_count()
+        f.write(self.pack_header(compress))
+        view = memoryview(self.blocks)
+        if not compress:
+            f.write(view)
+            return
+        frames = [zlib.compress(view[start:end], 1) for start, end in map(self.region_bounds, range(regions))]
+        f.write(b''.join(REGION_FRAME.pack(len(frame)) for frame in frames))
+        for frame in frames:
+            f.write(frame)
+
+    def prepare_save(self, filename, compress=False):
+        """Snapshot what has changed since the last save
+
+        Returns (regions, write) where write() does the file IO and is safe to run in
+        another thread, or None when the file is already up to date. Only the dirty
+        regions are rewritten when the file is a raw native file this level was saved
+        to or loaded from, otherwise the whole level is written to a temp file and renamed.
+        """
+        regions = self.dirty_regions
+        self.dirty_regions = set()
+        if not compress and self.saved_as == filename and os.path.isfile(filename):
+            if not regions:
+                return None
+            view = memoryview(self.blocks)
+            patches = [(start, bytes(view[start:end])) for start, end in map(self.region_bounds, sorted(regions))]
+            return regions, functools.partial(patch_level_file, filename, self.pack_header(), patches)
+        self.saved_as = None if compress else filename
+        return regions, functools.partial(self.copy().save_level, filename, compress)
+
+    def restore_dirty(self, regions):
+        """Put back regions from a save that failed, forcing the next save to be a full one"""
+        self.dirty_regions |= regions
+        self.saved_as = None
 
-    def save_level(self, filename):
-        """Save the level to a file"""
+    def save_legacy_level(self, filename):
+        """Save the level to a file in the legacy JSON format"""
         with open(filename, 'w') as f:
             level_data = {
                 'width': self.width,
@@ -94,10 +238,127 @@ class Level:
                 'rotSpawn': self.rotSpawn
             }
             f.write(json.dumps(level_data))
-        print(f"Level saved to {filename}")
+        log.info("Level saved to %s", filename)
 
-def load_level(filename):
-    """Load the level from a file"""
+def patch_path(filename):
+    return filename + '.patch'
+
+def patch_level_file(filename, header, patches):
+    """Overwrite the header and (offset, data) block ranges of a raw native level file
+
+    The ranges are made durable in a side file first and only then copied into the
+    level file, so a crash while patching is finished by read_level on the next load
+    instead of leaving a torn level.
+    """
+    body = header + b''.join(PATCH_RANGE.pack(offset, len(data)) + data for offset, data in patches)
+    with open(patch_path(filename), 'wb') as f:
+        f.write(body)
+        f.write(PATCH_CRC.pack(zlib.crc32(body)))
+        f.flush()
+        os.fsync(f.fileno())
+    write_patches(filename, header, patches)
+    os.remove(patch_path(filename))
+    log.info("Level saved to %s (%d regions)", filename, len(patches))
+
+def write_patches(filename, header, patches):
+    with open(filename, 'r+b') as f:
+        f.write(header)
+        for offset, data in patches:
+            f.seek(LEVEL_HEADER.size + offset)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def apply_pending_patch(filename):
+    """Finish a partial save that was interrupted, returns True if there was one to apply
+
+    A side file that was itself torn is dropped, the level file was not touched yet.
+    """
+    path = patch_path(filename)
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        data = f.read()
+    body = data[:-PATCH_CRC.size]
+    if len(body) < LEVEL_HEADER.size or PATCH_CRC.unpack(data[-PATCH_CRC.size:])[0] != zlib.crc32(body):
+        log.warning("Dropping incomplete partial save %s", path)
+        os.remove(path)
+        return False
+    patches = []
+    offset = LEVEL_HEADER.size
+    while offset < len(body):
+        start, length = PATCH_RANGE.unpack_from(body, offset)
+        offset += PATCH_RANGE.size
+        patches.append((start, body[offset:offset + length]))
+        offset += length
+    write_patches(filename, body[:LEVEL_HEADER.size], patches)
+    os.remove(path)
+    log.info("Finished an interrupted save of %s (%d regions)", filename, len(patches))
+    return True
+
+def discard_patch(filename):
+    try:
+        os.remove(patch_path(filename))
+    except FileNotFoundError:
+        pass
+
+def compress_blocks(blocks):
+    """Gzip a block buffer in XZY order with its length prefix"""
+    # Blocks are already stored in XZY order, so no reordering is needed
+    return gzip.compress(struct.pack('>I', len(blocks)) + blocks)
+
+def load_level(filename, use_mmap=False, journal=None):
+    """Load the level from a file, falling back to the legacy JSON format
+
+    If a journal is given, the block changes it recorded after the last save are
+    replayed on top.
+    """
+    level = read_level(filename, use_mmap)
+    if journal is not None:
+        journal.replay(level)
+    return level
+
+def read_level(filename, use_mmap=False):
+    apply_pending_patch(filename)
+    with open(filename, 'rb') as f:
+        header = f.read(LEVEL_HEADER.size)
+        if header[:4] != LEVEL_MAGIC:
+            return load_legacy_level(filename)
+
+        (magic, version, flags, width, height, depth,
+         xSpawn, ySpawn, zSpawn, rotSpawn, region_layers, regions) = LEVEL_HEADER.unpack(header)
+        if version > LEVEL_FORMAT_VERSION:
+            raise ValueError(f"{filename} uses level format {version}, newer than supported {LEVEL_FORMAT_VERSION}")
+
+        level = Level()
+        level.xSpawn = xSpawn
+        level.ySpawn = ySpawn
+        level.zSpawn = zSpawn
+        level.rotSpawn = rotSpawn
+        size = width * height * depth
+        if flags & LEVEL_FLAG_COMPRESSED:
+            level.allocate(width, height, depth)
+            lengths = [REGION_FRAME.unpack(f.read(REGION_FRAME.size))[0] for _ in range(regions)]
+            layer = width * depth
+            for region, length in enumerate(lengths):
+                start = region * region_layers * layer
+                data = zlib.decompress(f.read(length))
+                level.blocks[start:start + len(data)] = data
+        elif use_mmap:
+            # Copy-on-write mapping: pages are read lazily and edits never touch the file
+            level.width, level.height, level.depth = width, height, depth
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            level.blocks = memoryview(mapped)[LEVEL_HEADER.size:LEVEL_HEADER.size + size]
+        else:
+            level.allocate(width, height, depth)
+            f.readinto(level.blocks)
+        if not flags & LEVEL_FLAG_COMPRESSED and region_layers == REGION_LAYERS:
+            level.saved_as = filename
+    log.info("Level loaded from %s", filename)
+    return level
+
+def load_legacy_level(filename):
+    """Load the level from a legacy JSON file"""
     level = Level()
     with open (filename, 'r') as f:
         level_data = json.loads(f.read())
@@ -109,34 +370,54 @@ def load_level(filename):
         level.ySpawn = level_data['ySpawn']
         level.zSpawn = level_data['zSpawn']
         level.rotSpawn = level_data['rotSpawn']
-    print(f"Level loaded from {filename}")
+    log.info("Level loaded from %s (legacy format)", filename)
     return level
 
+def convert_level(source, destination=None, compress=False):
+    """Convert a level file (legacy or native) to the native format"""
+    level = load_level(source)
+    level.save_level(destination or source, compress)
+    return level
+
+
+class Generator:
+    """Base class for level generators
+
+    generate() fills level.blocks in place and may move the spawn point, the level
+    is already allocated (all AIR) with the spawn in the middle of the map.
+    """
+    def __init__(self, seed=0):
+        self.seed = seed
 
-def make_level(width, height, depth):
-    """Create a new level with given dimensions"""
+    def generate(self, level):
+        raise NotImplementedError
+
+class FlatGenerator(Generator):
+    """Dirt up to the middle of the map with a single layer of grass on top"""
+    def generate(self, level):
+        grass_y = math.floor(level.height // 2) - 1  # Grass layer sits in the middle of the height
+        level.fill_layers(0, grass_y, Blocks.DIRT)  # Everything below the grass is DIRT
+        level.fill_layers(grass_y, grass_y + 1, Blocks.GRASS)
+
+# Generator name -> class, other modules register their own generators here
+GENERATORS = {'flat': FlatGenerator}
+
+def get_generator(name, seed=0):
+    """Create a registered generator by name"""
+    if name not in GENERATORS:
+        raise ValueError(f"Unknown level generator '{name}', expected one of {', '.join(GENERATORS)}")
+    return GENERATORS[name](seed)
+
+def make_level(width, height, depth, generator=None):
+    """Create a new level with given dimensions, flat unless another generator is given"""
     level = Level()
-    level.width = width    # X (width)
-    level.height = height  # Z (height)
-    level.depth = depth    # Y (depth/length)
-    level.blocks = [Blocks.AIR] * (width * height * depth)  # Initialize all blocks to AIR
+    level.allocate(width, height, depth, Blocks.AIR)  # X (width), Y (height), Z (depth/length)
     level.xSpawn = round(width // 2)  # Spawn point X (middle of width)
     level.ySpawn = math.floor(height // 2) + 1  # Spawn point Y (middle of height)
     level.zSpawn = round(depth // 2)  # Spawn point Z (middle of depth)
 
-    grass_layer_start = (math.floor(height // 2) - 1) * (width * depth)  # Start index of the grass layer (middle of the depth)
-    for z in range(depth):
-        for x in range(width):
-            index = grass_layer_start + x + (z * width)
-            level.blocks[index] = Blocks.GRASS  # Set the middle layer to GRASS
-
-    # Set the layer below grass to DIRT
-    for y in range(math.floor(height // 2) - 2, -1, -1):  # Start below grass layer and go down to the bottom
-        dirt_layer_start = y * (width * depth)
-        for z in range(depth):
-            for x in range(width):
-                index = dirt_layer_start + x + (z * width)
-                level.blocks[index] = Blocks.DIRT
+    (generator or FlatGenerator()).generate(level)
+    level.touch()
 
     return level
 
@@ -191,3 +472,12 @@ class Blocks:
     BOOKCASE = 47
     STONEVINE = 48
     OBSIDIAN = 49
+
+if __name__ == "__main__":
+    # python LevelTool.py convert main.lvl [output.lvl] [--compress]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = [arg for arg in sys.argv[1:] if arg != '--compress']
+    if len(args) in (2, 3) and args[0] == 'convert':
+        convert_level(args[1], args[2] if len(args) == 3 else None, '--compress' in sys.argv)
+    else:
+        print("Usage: python LevelTool.py convert <level> [output] [--compress]")
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class Counter:
+    """Monotonic count, optionally split by one label"""
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}  # Label value (None without a label) -> count
+
+    def inc(self, label=None, amount=1):
+        values = self.values
+        values[label] = values.get(label, 0) + amount
+
+    def samples(self):
+        for label, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            yield (self.name if label is None else f'{self.name}{{{self.label}="{label}"}}'), value
+
+class Gauge:
+    """Current value, set directly or read from a function when scraped"""
+    kind = "gauge"
+
+    def __init__(self, name, help, func=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.func() if self.func is not None else self.value
+
+class Summary:
+    """Count, sum and max of observed durations, with quantiles over the most recent ones"""
+    kind = "summary"
+
+    def __init__(self, name, help, window=1024):
+        self.name = name
+        self.help = help
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        self.recent.append(value)
+
+    def time(self):
+        """Context manager that observes the seconds spent inside it"""
+        return Timer(self)
+
+    def samples(self):
+        ordered = sorted(self.recent)
+        for quantile in (0.5, 0.9, 0.99):
+            value = ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] if ordered else 0
+            yield f'{self.name}{{quantile="{quantile}"}}', value
+        yield f"{self.name}_sum", self.sum
+        yield f"{self.name}_count", self.count
+        yield f"{self.name}_max", self.max
+
+class Timer:
+    __slots__ = ('summary', 'start')
+
+    def __init__(self, summary):
+        self.summary = summary
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.summary.observe(time.perf_counter() - self.start)
+
+class Registry:
+    """In-process metrics, rendered in the Prometheus text format"""
+    def __init__(self, prefix="mcsnake_"):
+        self.prefix = prefix
+        self.metrics = []
+
+    def add(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.add(Counter(name, help, label))
+
+    def gauge(self, name, help, func=None):
+        return self.add(Gauge(name, help, func))
+
+    def summary(self, name, help):
+        return self.add(Summary(name, help))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, value in metric.samples():
+                    lines.append(f"{name} {value:.6g}" if isinstance(value, float) else f"{name} {value}")
+            except Exception as e:
+                log.warning("Could not read metric %s: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+async def watch_loop_lag(gauge, summary, interval=0.5):
+    """Measure how late the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        gauge.set(lag)
+        summary.observe(lag)
+
+class Profiler:
+    """Sampling profiler for a live server
+
+    While running, a background thread records the stack of the event loop thread
+    every interval seconds. Stacks are reported in the collapsed format flame graph
+    tools read, so the cost is zero while it is off and a few percent while on.
+    """
+    def __init__(self, interval=0.005):
+        self.thread_id = None
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        """Start sampling the calling thread, False if already running"""
+        if self.thread is not None:
+            return False
+        self.stacks.clear()
+        self.samples = 0
+        self.thread_id = threading.get_ident()  # Started from the loop, so this is the loop's thread
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+        log.info("Profiler started")
+        return True
+
+    def stop(self):
+        """Stop sampling and return the report"""
+        if self.thread is None:
+            return self.report()
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        log.info("Profiler stopped after %d samples", self.samples)
+        return self.report()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, limit=None):
+        """Collapsed stacks with their sample counts, most frequent first"""
+        stacks = dict.copy(self.stacks)  # The sampling thread may be adding to it
+        ordered = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return ''.join(f"{stack} {count}\n" for stack, count in ordered)
+
+class Endpoint:
+    """Minimal local HTTP server for metrics and the profiler
+
+    GET /metrics         registry in the Prometheus text format
+    GET /profile/start   start the sampling profiler
+    GET /profile/stop    stop it and return the collapsed stacks
+    GET /profile         collapsed stacks so far
+    """
+    def __init__(self, registry, profiler):
+        self.registry = registry
+        self.profiler = profiler
+
+    async def start(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info("Metrics on http://%s:%s/metrics", host, port)
+        return server
+
+    async def route(self, path):
+        if path == "/metrics":
+            return 200, self.registry.render()
+        if path == "/profile/start":
+            return 200, "started\n" if self.profiler.start() else "already running\n"
+        if path == "/profile/stop":
+            # Joins the sampling thread, keep that off the loop
+            return 200, await asyncio.get_running_loop().run_in_executor(None, self.profiler.stop)
+        if path == "/profile":
+            return 200, self.profiler.report()
+        return 404, "not found\n"
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            parts = request.split(b' ', 2)
+            path = parts[1].decode('ascii', 'ignore').split('?', 1)[0] if len(parts) > 2 else ''
+            status, body = await self.route(path)
+            body = body.encode('utf-8')
+            writer.write(f"HTTP/1.0 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
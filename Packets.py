@@ -0,0 +1,259 @@
+import struct
+
+# Precompiled layouts of the client -> server packets (payload only, without the id byte)
+LOGIN = struct.Struct('>B64s64sB')   # protocol version, username, verification key, unused
+MESSAGE = struct.Struct('>B64s')     # unused (player id), message
+SET_BLOCK = struct.Struct('>hhhBB')  # x, y, z, mode, block id
+POSITION = struct.Struct('>BhhhBB')  # player id, x, y, z, yaw, pitch
+EXT_INFO = struct.Struct('>64sh')    # app name, extension count
+EXT_ENTRY = struct.Struct('>64si')   # extension name, version
+EXT_POSITION = struct.Struct('>BiiiBB')  # POSITION with ExtEntityPositions
+
+# Sent in the unused byte of the login packet by clients that speak CPE
+CPE_MAGIC = 0x42
+
+class UnknownPacket(Exception):
+    """Raised when a client sends a packet id the server cannot frame"""
+    def __init__(self, packet_id):
+        super().__init__(f"Unknown packet ID: {packet_id}")
+        self.packet_id = packet_id
+
+def decode_string(data):
+    return bytes(data).decode('ascii', 'ignore').strip(' ')
+
+def encode_string(text):
+    return text.encode('ascii', 'replace')[:64].ljust(64, b' ')
+
+class Login:
+    ID = 0x00
+    __slots__ = ('ver', 'username', 'verification', 'cpe')
+
+    def __init__(self, ver, username, verification, cpe=False):
+        self.ver = ver
+        self.username = username
+        self.verification = verification
+        self.cpe = cpe  # The client wants to negotiate extensions
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        ver, username, verification, magic = LOGIN.unpack_from(buffer, offset)
+        return cls(ver, decode_string(username), decode_string(verification), magic == CPE_MAGIC)
+
+class Message:
+    ID = 0x0d
+    __slots__ = ('message',)
+
+    def __init__(self, message):
+        self.message = message
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        _, message = MESSAGE.unpack_from(buffer, offset)
+        return cls(decode_string(message))
+
+class SetBlock:
+    ID = 0x05
+    __slots__ = ('x', 'y', 'z', 'mode', 'block_id')
+
+    def __init__(self, x, y, z, mode, block_id):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.mode = mode
+        self.block_id = block_id
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        return cls(*SET_BLOCK.unpack_from(buffer, offset))
+
+class Position:
+    ID = 0x08
+    __slots__ = ('x', 'y', 'z', 'yaw', 'pitch')
+
+    def __init__(self, x, y, z, yaw, pitch):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.yaw = yaw
+        self.pitch = pitch
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        _, x, y, z, yaw, pitch = POSITION.unpack_from(buffer, offset)
+        return cls(x, y, z, yaw, pitch)
+
+class ExtPosition(Position):
+    """Position with int coordinates, sent by clients that negotiated ExtEntityPositions"""
+    __slots__ = ()
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        _, x, y, z, yaw, pitch = EXT_POSITION.unpack_from(buffer, offset)
+        return cls(x, y, z, yaw, pitch)
+
+class ExtInfo:
+    ID = 0x10
+    __slots__ = ('app_name', 'extension_count')
+
+    def __init__(self, app_name, extension_count):
+        self.app_name = app_name
+        self.extension_count = extension_count
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        app_name, extension_count = EXT_INFO.unpack_from(buffer, offset)
+        return cls(decode_string(app_name), extension_count)
+
+class ExtEntry:
+    ID = 0x11
+    __slots__ = ('name', 'version')
+
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+
+    @classmethod
+    def decode(cls, buffer, offset):
+        name, version = EXT_ENTRY.unpack_from(buffer, offset)
+        return cls(decode_string(name), version)
+
+# Packet id -> (payload length, packet class)
+CLIENT_PACKETS = {
+    Login.ID: (LOGIN.size, Login),
+    Message.ID: (MESSAGE.size, Message),
+    SetBlock.ID: (SET_BLOCK.size, SetBlock),
+    Position.ID: (POSITION.size, Position),
+    ExtInfo.ID: (EXT_INFO.size, ExtInfo),
+    ExtEntry.ID: (EXT_ENTRY.size, ExtEntry),
+}
+
+# The same for clients that negotiated ExtEntityPositions
+EXT_POSITION_CLIENT_PACKETS = dict(CLIENT_PACKETS)
+EXT_POSITION_CLIENT_PACKETS[Position.ID] = (EXT_POSITION.size, ExtPosition)
+
+def decode(data):
+    """Decode a single packet (id byte included), None if it is unknown or truncated"""
+    entry = CLIENT_PACKETS.get(data[0]) if data else None
+    if entry is None or len(data) < entry[0] + 1:
+        return None
+    return entry[1].decode(data, 1)
+
+def parse(buffer, client_packets=CLIENT_PACKETS):
+    """Decode every complete packet at the start of buffer
+
+    Returns (packets, consumed) so the caller can drop the consumed bytes and keep the
+    partial packet at the end for the next read.
+    """
+    packets = []
+    offset = 0
+    end = len(buffer)
+    while offset < end:
+        entry = client_packets.get(buffer[offset])
+        if entry is None:
+            raise UnknownPacket(buffer[offset])
+        length, packet_type = entry
+        if offset + 1 + length > end:
+            break
+        packets.append(packet_type.decode(buffer, offset + 1))
+        offset += 1 + length
+    return packets, offset
+
+async def read_packets(reader, read_size=4096, client=None):
+    """Yield batches of decoded packets from a StreamReader, several per recv when available
+
+    If given, client.client_packets is the packet table to parse with. It is read again
+    for every batch, since negotiated extensions change the layout of some packets.
+    """
+    buffer = bytearray()
+    while True:
+        data = await reader.read(read_size)
+        if not data:
+            return
+        buffer += data
+        packets, consumed = parse(buffer, client.client_packets if client is not None else CLIENT_PACKETS)
+        if consumed:
+            del buffer[:consumed]
+        if packets:
+            yield packets
+
+# Length of every server -> client packet, id byte included
+SERVER_PACKET_SIZES = {
+    0x00: 131, 0x01: 1, 0x02: 1, 0x03: 1028, 0x04: 7, 0x06: 8, 0x07: 74, 0x08: 10,
+    0x09: 7, 0x0a: 5, 0x0b: 4, 0x0c: 2, 0x0d: 66, 0x0e: 65, 0x0f: 2,
+    0x10: 67, 0x11: 69, 0x26: 1282,
+}
+
+# Server -> client CPE negotiation packets, id byte included
+SERVER_EXT_INFO = struct.Struct('>B64sh')   # 0x10 app name, extension count
+SERVER_EXT_ENTRY = struct.Struct('>B64si')  # 0x11 extension name, version
+
+def ext_info_packets(app_name, extensions):
+    """ExtInfo followed by an ExtEntry for every {name: version} the server supports"""
+    return SERVER_EXT_INFO.pack(0x10, encode_string(app_name), len(extensions)) + b''.join(
+        SERVER_EXT_ENTRY.pack(0x11, encode_string(name), version) for name, version in extensions.items())
+
+# Server -> client block packets, id byte included
+BLOCK_CHANGE = struct.Struct('>BhhhB')          # 0x06 x, y, z, block id
+BULK_BLOCK_UPDATE = struct.Struct('>BB1024s256s')  # 0x26 count - 1, 256 int block indices, 256 block ids
+# From this many changes on one BulkBlockUpdate is smaller than the 0x06 packets
+BULK_MIN_CHANGES = BULK_BLOCK_UPDATE.size // BLOCK_CHANGE.size + 1
+BULK_INDICES = struct.Struct('>256i')
+
+def block_change_packets(changes):
+    """0x06 packets for (x, y, z, block id, ...) changes"""
+    pack = BLOCK_CHANGE.pack
+    return b''.join(pack(0x06, change[0], change[1], change[2], change[3]) for change in changes)
+
+def bulk_block_packets(changes, width, depth):
+    """BulkBlockUpdate packets for (x, y, z, block id, ...) changes in a level of width x depth"""
+    packets = []
+    for start in range(0, len(changes), 256):
+        group = changes[start:start + 256]
+        indices = [change[0] + width * (change[2] + depth * change[1]) for change in group]
+        indices += [0] * (256 - len(group))
+        packets.append(BULK_BLOCK_UPDATE.pack(0x26, len(group) - 1, BULK_INDICES.pack(*indices),
+                                              bytes(change[3] for change in group)))
+    return b''.join(packets)
+
+# Server -> client movement packets, id byte included
+TELEPORT = struct.Struct('>BbhhhBB')                     # 0x08 player id, x, y, z, yaw, pitch
+EXT_TELEPORT = struct.Struct('>BbiiiBB')                 # 0x08 with ExtEntityPositions
+POSITION_ORIENTATION_UPDATE = struct.Struct('>BbbbbBB')  # 0x09 player id, dx, dy, dz, yaw, pitch
+POSITION_UPDATE = struct.Struct('>Bbbbb')                # 0x0a player id, dx, dy, dz
+ORIENTATION_UPDATE = struct.Struct('>BbBB')              # 0x0b player id, yaw, pitch
+
+def short_position(position):
+    """Position with the coordinates clamped to what vanilla packets can carry"""
+    x, y, z, yaw, pitch = position
+    return (min(max(x, -32768), 32767), min(max(y, -32768), 32767), min(max(z, -32768), 32767), yaw, pitch)
+
+def teleport_packet(player_id, position, extended=False):
+    """Absolute position packet for position = (x, y, z, yaw, pitch)
+
+    With int coordinates if extended, otherwise clamped to the short range.
+    """
+    if extended:
+        return EXT_TELEPORT.pack(0x08, player_id, *position)
+    return TELEPORT.pack(0x08, player_id, *short_position(position))
+
+def move_packet(player_id, old, new):
+    """Smallest packet moving a player from old to new, None if nothing changed
+
+    Too far for a relative move it is a vanilla teleport, which clients with
+    ExtEntityPositions must get as teleport_packet(..., extended=True) instead.
+    """
+    x, y, z, yaw, pitch = new
+    dx = x - old[0]
+    dy = y - old[1]
+    dz = z - old[2]
+    if not (-128 <= dx <= 127 and -128 <= dy <= 127 and -128 <= dz <= 127):
+        return teleport_packet(player_id, new)
+    moved = dx or dy or dz
+    turned = yaw != old[3] or pitch != old[4]
+    if moved and turned:
+        return POSITION_ORIENTATION_UPDATE.pack(0x09, player_id, dx, dy, dz, yaw, pitch)
+    if moved:
+        return POSITION_UPDATE.pack(0x0a, player_id, dx, dy, dz)
+    if turned:
+        return ORIENTATION_UPDATE.pack(0x0b, player_id, yaw, pitch)
+    return None
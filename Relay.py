@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import multiprocessing
+import socket
+import struct
+
+import Log
+
+log = logging.getLogger(__name__)
+
+# Frames between a gateway process and the authoritative process
+FRAME = struct.Struct('>BII')  # kind, client id, payload length
+OPEN = 1   # A client connected, payload is its "host:port"
+DATA = 2   # Bytes from or for the client
+CLOSE = 3  # Either side closed the client
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT")
+
+class RelayWriter:
+    """Stands in for the StreamWriter of a client connected to a gateway
+
+    Writes become DATA frames on the gateway link. The gateway does the socket work
+    and disconnects clients that stop reading, since drain() here only waits for the
+    link.
+    """
+    def __init__(self, link, client_id, peername, reader):
+        self.link = link
+        self.client_id = client_id
+        self.peername = peername
+        self.reader = reader
+        self.transport = self  # Connection.evict aborts writer.transport
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        return self.peername if name == 'peername' else default
+
+    def write(self, data):
+        if not self.closed and data:
+            self.link.writelines((FRAME.pack(DATA, self.client_id, len(data)), data))
+
+    async def drain(self):
+        await self.link.drain()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.link.write(FRAME.pack(CLOSE, self.client_id, 0))
+
+    def abort(self):
+        self.close()
+        self.reader.feed_eof()
+
+    def is_closing(self):
+        return self.closed
+
+    async def wait_closed(self):
+        pass
+
+class RelayServer:
+    """Accepts links from gateway processes and runs handle_client for each client they relay"""
+    def __init__(self, handle_client):
+        self.handle_client = handle_client
+        self.tasks = set()  # Client tasks, referenced until they finish
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1'):
+        """Listen for gateway links on a free local port, returns self"""
+        self.server = await asyncio.start_server(self.handle_link, host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def handle_link(self, reader, writer):
+        clients = {}  # Client id -> (StreamReader, RelayWriter)
+        try:
+            while True:
+                kind, client_id, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+                payload = await reader.readexactly(length) if length else b''
+                if kind == DATA:
+                    client = clients.get(client_id)
+                    if client is not None:
+                        client[0].feed_data(payload)
+                elif kind == OPEN:
+                    host, _, port = payload.decode('ascii').rpartition(':')
+                    client_reader = asyncio.StreamReader()
+                    client_writer = RelayWriter(writer, client_id, (host, int(port)), client_reader)
+                    clients[client_id] = client_reader, client_writer
+                    task = asyncio.create_task(self.run_client(clients, client_id, client_reader, client_writer))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+                elif kind == CLOSE:
+                    client = clients.pop(client_id, None)
+                    if client is not None:
+                        client[1].closed = True
+                        client[0].feed_eof()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.warning("Gateway link closed")
+        finally:
+            for client_reader, client_writer in clients.values():
+                client_writer.closed = True
+                client_reader.feed_eof()
+            writer.close()
+
+    async def run_client(self, clients, client_id, reader, writer):
+        try:
+            await self.handle_client(reader, writer)
+        finally:
+            clients.pop(client_id, None)
+
+class Gateway:
+    """Networking process: accepts clients on the shared port and relays them over one link
+
+    Every gateway binds the public port with SO_REUSEPORT, so the kernel spreads new
+    connections over the processes. Socket reads and writes happen here, the world
+    state stays in the authoritative process.
+    """
+    def __init__(self, host, port, relay_port, send_limit):
+        self.host = host
+        self.port = port
+        self.relay_port = relay_port
+        self.send_limit = send_limit
+        self.clients = {}  # Client id -> StreamWriter
+        self.next_id = 1
+        self.link = None
+
+    async def run(self):
+        link_reader, self.link = await asyncio.open_connection('127.0.0.1', self.relay_port)
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_port=True)
+        log.info("Gateway listening on %s:%s", self.host, self.port)
+        async with server:
+            await self.forward(link_reader)
+
+    async def handle_client(self, reader, writer):
+        client_id = self.next_id
+        self.next_id += 1
+        self.clients[client_id] = writer
+        peer = writer.get_extra_info('peername')
+        address = f"{peer[0]}:{peer[1]}".encode('ascii')
+        self.link.write(FRAME.pack(OPEN, client_id, len(address)) + address)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.link.writelines((FRAME.pack(DATA, client_id, len(data)), data))
+                await self.link.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if self.clients.pop(client_id, None) is not None:
+                self.link.write(FRAME.pack(CLOSE, client_id, 0))
+            writer.close()
+
+    async def forward(self, link_reader):
+        """Write what the authoritative process sends to the clients, until the link closes"""
+        try:
+            while True:
+                kind, client_id, length = FRAME.unpack(await link_reader.readexactly(FRAME.size))
+                payload = await link_reader.readexactly(length) if length else b''
+                writer = self.clients.get(client_id)
+                if writer is None:
+                    continue
+                if kind == DATA:
+                    writer.write(payload)
+                    # Never wait on one client, drop it once it falls too far behind
+                    if writer.transport.get_write_buffer_size() > self.send_limit:
+                        log.warning("Disconnecting %s: send buffer over limit", writer.get_extra_info('peername'))
+                        del self.clients[client_id]
+                        self.link.write(FRAME.pack(CLOSE, client_id, 0))
+                        writer.transport.abort()
+                elif kind == CLOSE:
+                    del self.clients[client_id]
+                    writer.close()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.info("Authoritative process went away, gateway stopping")
+
+def run_gateway(host, port, relay_port, send_limit, log_level="INFO", log_format="text"):
+    """Process entry point for a gateway"""
+    Log.setup(log_level, log_format)
+    try:
+        asyncio.run(Gateway(host, port, relay_port, send_limit).run())
+    except KeyboardInterrupt:
+        pass
+
+def start_gateways(count, host, port, relay_port, send_limit, log_level="INFO", log_format="text"):
+    """Start count gateway processes, returns them"""
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for _ in range(count):
+        process = context.Process(target=run_gateway, args=(host, port, relay_port, send_limit, log_level, log_format), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
@@ -0,0 +1,71 @@
+class SpatialGrid:
+    """Uniform grid over the level's X/Z plane for finding players within a view radius
+
+    Points are in block coordinates. A radius of 0 or less means unlimited, every
+    point is then near every other one.
+    """
+    def __init__(self, radius, cell_size=None):
+        self.radius = radius
+        self.cell_size = cell_size or max(16, int(radius) // 2)
+        # Cells a point can be from another and still be within the radius
+        self.reach = -(-int(radius) // self.cell_size) if radius > 0 else 0
+        self.cells = {}   # (cx, cz) -> set of ids
+        self.points = {}  # id -> (x, z)
+        self.where = {}   # id -> (cx, cz)
+
+    @property
+    def unlimited(self):
+        return self.radius <= 0
+
+    def cell_of(self, x, z):
+        return (x // self.cell_size, z // self.cell_size)
+
+    def insert(self, id, x, z):
+        cell = self.cell_of(x, z)
+        self.points[id] = (x, z)
+        self.where[id] = cell
+        self.cells.setdefault(cell, set()).add(id)
+
+    def move(self, id, x, z):
+        cell = self.cell_of(x, z)
+        self.points[id] = (x, z)
+        old = self.where.get(id)
+        if old == cell:
+            return
+        if old is not None:
+            self.discard_from_cell(id, old)
+        self.where[id] = cell
+        self.cells.setdefault(cell, set()).add(id)
+
+    def remove(self, id):
+        self.points.pop(id, None)
+        cell = self.where.pop(id, None)
+        if cell is not None:
+            self.discard_from_cell(id, cell)
+
+    def discard_from_cell(self, id, cell):
+        members = self.cells[cell]
+        members.discard(id)
+        if not members:
+            del self.cells[cell]
+
+    def near_cells(self, a, b):
+        """Whether anything in cell a may be within the radius of cell b"""
+        return self.unlimited or (abs(a[0] - b[0]) <= self.reach and abs(a[1] - b[1]) <= self.reach)
+
+    def query(self, id):
+        """Ids of every other point within the radius of point id"""
+        if self.unlimited:
+            return set(self.points) - {id}
+        x, z = self.points[id]
+        cx, cz = self.where[id]
+        radius_sq = self.radius * self.radius
+        found = set()
+        for i in range(cx - self.reach, cx + self.reach + 1):
+            for j in range(cz - self.reach, cz + self.reach + 1):
+                for other in self.cells.get((i, j), ()):
+                    ox, oz = self.points[other]
+                    if (ox - x) * (ox - x) + (oz - z) * (oz - z) <= radius_sq:
+                        found.add(other)
+        found.discard(id)
+        return found
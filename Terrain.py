@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import LevelTool
+from LevelTool import Blocks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SLAB_ROWS = 32  # Z rows per slab, fixed so the output does not depend on the worker count
+PARALLEL_THRESHOLD = 1 << 25  # Levels with fewer blocks are generated in this process
+
+def hash2(x, z, seed):
+    """Deterministic per-column random values in [0, 1) for integer coordinate arrays"""
+    h = (x.astype(np.int64) * 374761393 + z.astype(np.int64) * 668265263 + (seed & 0x7fffffff) * 1442695041) & 0xffffffff
+    h = ((h ^ (h >> 13)) * 1274126177) & 0xffffffff
+    h ^= h >> 16
+    return h.astype(np.float64) / 4294967296.0
+
+def value_noise(xs, zs, scale, seed):
+    """Smoothed value noise with lattice cells of scale blocks, shape (len(zs), len(xs))"""
+    fx, ix = np.modf(xs / scale)
+    fz, iz = np.modf(zs / scale)
+    ix = ix.astype(np.int64)[None, :]
+    iz = iz.astype(np.int64)[:, None]
+    fx = (fx * fx * (3 - 2 * fx))[None, :]
+    fz = (fz * fz * (3 - 2 * fz))[:, None]
+    top = hash2(ix, iz, seed) * (1 - fx) + hash2(ix + 1, iz, seed) * fx
+    bottom = hash2(ix, iz + 1, seed) * (1 - fx) + hash2(ix + 1, iz + 1, seed) * fx
+    return top * (1 - fz) + bottom * fz
+
+def generate_slab(width, height, water_level, heights, seed, slab):
+    """Build the [y, z, x] blocks of one slab of columns from its heightmap rows"""
+    y = np.arange(height, dtype=np.int32)[:, None, None]
+    h = heights[None, :, :]
+    top = np.where(heights <= water_level + 1, Blocks.SAND, Blocks.GRASS).astype(np.uint8)[None, :, :]
+
+    water = np.where(y <= water_level, Blocks.WATERSTILL, Blocks.AIR).astype(np.uint8)
+    blocks = np.where(y < h, np.uint8(Blocks.DIRT), np.where(y == h, top, water))
+    rock = y < h - 3
+    blocks[rock] = Blocks.ROCK
+
+    # Ores are scattered through the rock, rarer ores only deep down
+    rng = np.random.default_rng([seed & 0xffffffff, slab])
+    roll = rng.random(blocks.shape, dtype=np.float32)
+    blocks[rock & (roll < 0.010)] = Blocks.COAL
+    blocks[rock & (roll >= 0.010) & (roll < 0.016) & (y < h - 8)] = Blocks.IRONROCK
+    blocks[rock & (roll >= 0.016) & (roll < 0.019) & (y < height // 4)] = Blocks.GOLDROCK
+
+    blocks[0] = Blocks.BLACKROCK
+    return blocks
+
+def generate_slab_bytes(args):
+    """Process pool entry point, returns the slab as bytes"""
+    return generate_slab(*args).tobytes()
+
+class TerrainGenerator(LevelTool.Generator):
+    """Hills from layered value noise with rock/dirt strata, water, ores and trees
+
+    Deterministic for a given seed and level size. Large levels are generated in
+    Z slabs across a process pool.
+    """
+    def __init__(self, seed=0, water_level=None, tree_density=0.004, workers=None):
+        super().__init__(seed)
+        self.water_level = water_level
+        self.tree_density = tree_density
+        self.workers = workers
+
+    def heightmap(self, width, height, depth):
+        xs = np.arange(width, dtype=np.float64)
+        zs = np.arange(depth, dtype=np.float64)
+        noise = np.zeros((depth, width))
+        amplitude = 1.0
+        total = 0.0
+        for octave, scale in enumerate((64, 32, 16, 8)):
+            noise += value_noise(xs, zs, scale, self.seed + octave) * amplitude
+            total += amplitude
+            amplitude /= 2
+        hills = (noise / total - 0.5) * 2 * (height // 4)
+        return np.clip(height // 2 + hills, 1, height - 10).astype(np.int32)
+
+    def generate(self, level):
+        if np is None:
+            raise RuntimeError("NumPy is required for the terrain generator")
+        width, height, depth = level.width, level.height, level.depth
+        water_level = height // 2 - 4 if self.water_level is None else self.water_level
+        heights = self.heightmap(width, height, depth)
+        blocks = level.as_array()
+
+        slabs = [(width, height, water_level, heights[z:z + SLAB_ROWS], self.seed, i)
+                 for i, z in enumerate(range(0, depth, SLAB_ROWS))]
+        workers = self.workers
+        if workers is None:
+            workers = os.cpu_count() if width * height * depth >= PARALLEL_THRESHOLD else 1
+        if workers > 1 and len(slabs) > 1:
+            # Spawned, generation can run while client sockets are open and forked workers would keep them
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                for args, data in zip(slabs, pool.map(generate_slab_bytes, slabs)):
+                    z = args[5] * SLAB_ROWS
+                    blocks[:, z:z + args[3].shape[0], :] = np.frombuffer(data, dtype=np.uint8).reshape(height, -1, width)
+        else:
+            for args in slabs:
+                z = args[5] * SLAB_ROWS
+                blocks[:, z:z + args[3].shape[0], :] = generate_slab(*args)
+
+        self.plant_trees(blocks, heights, water_level)
+
+        # Spawn on the ground in the middle of the map
+        level.ySpawn = int(heights[level.zSpawn, level.xSpawn]) + 2
+
+    def plant_trees(self, blocks, heights, water_level):
+        height, depth, width = blocks.shape
+        zs, xs = np.mgrid[0:depth, 0:width]
+        chance = hash2(xs, zs, self.seed + 100)
+        candidates = ((chance < self.tree_density) & (heights > water_level + 1) & (heights < height - 8)
+                      & (xs >= 2) & (xs < width - 2) & (zs >= 2) & (zs < depth - 2))
+        for z, x in zip(*np.nonzero(candidates)):
+            ground = heights[z, x]
+            trunk = 4 + int(chance[z, x] * 1000) % 2
+            top = ground + trunk
+            # Two wide layers of leaves around the top of the trunk, a narrow one above
+            canopy = blocks[top - 1:top + 1, z - 2:z + 3, x - 2:x + 3]
+            canopy[canopy == Blocks.AIR] = Blocks.LEAF
+            crown = blocks[top + 1, z - 1:z + 2, x - 1:x + 2]
+            crown[crown == Blocks.AIR] = Blocks.LEAF
+            blocks[ground + 1:top + 1, z, x] = Blocks.TRUNK
+            blocks[ground, z, x] = Blocks.DIRT
+
+LevelTool.GENERATORS['terrain'] = TerrainGenerator
@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import connection, shared_memory
+
+SEGMENT_SIZE = 262144  # Bytes of blocks compressed per job
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+def compress_segment(blocks, start, end, raw=False):
+    """Deflate blocks[start:end] as part of a map stream, returns (data, trailer)
+
+    Every segment has its own compressor and ends on a sync flush, so the segments
+    can be compressed in parallel and concatenated. The last one finishes the stream
+    and, unless raw, also returns the gzip trailer over the whole map.
+    """
+    size = len(blocks)
+    compressor = zlib.compressobj(wbits=-15)
+    prefix = b'' if raw or start else struct.pack('>I', size)  # Vanilla maps start with their length
+    data = compressor.compress(prefix) + compressor.compress(blocks[start:end])
+    if end < size:
+        return data + compressor.flush(zlib.Z_SYNC_FLUSH), b''
+    data += compressor.flush()
+    if raw:
+        return data, b''
+    crc = zlib.crc32(blocks, zlib.crc32(struct.pack('>I', size)))
+    return data, struct.pack('<II', crc, (size + 4) & 0xffffffff)
+
+def compress_shared_segment(name, size, start, end, raw=False):
+    """Worker entry point, compresses a segment of the blocks in a shared memory segment"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            return compress_segment(view, start, end, raw)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+def exit_with_parent():
+    """Worker initializer, ends the worker if the server dies without shutting the pool down"""
+    parent = multiprocessing.parent_process()
+    def watch():
+        connection.wait([parent.sentinel])
+        os._exit(0)
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+class EncodePool:
+    """Process pool for compressing levels off the event loop and past one core
+
+    Blocks are copied into a shared memory segment the worker attaches to, so the
+    level is never pickled; only the much smaller compressed segments come back. With
+    workers = 0 compression runs in the default thread pool instead.
+    """
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = None
+
+    def start(self):
+        if self.workers > 0 and self.executor is None:
+            # Spawned, a forked worker would keep copies of the client sockets open
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=exit_with_parent)
+
+    async def warm_up(self):
+        """Start the worker processes and wait until they take jobs, so the first map is not slower"""
+        self.start()
+        if self.executor is not None:
+            await asyncio.gather(*(asyncio.wrap_future(self.executor.submit(int)) for _ in range(self.workers)))
+
+    def level_chunks(self, blocks, raw=False):
+        """Start compressing blocks into map chunks, returns an async iterator of (data, percent)
+
+        The snapshot of blocks is taken before this returns, later edits don't affect
+        it. Chunks come out as soon as the segments they are in are compressed, so the
+        first ones can be sent while the rest of the level is still being worked on.
+        """
+        loop = asyncio.get_running_loop()
+        size = len(blocks)
+        bounds = [(start, min(start + SEGMENT_SIZE, size)) for start in range(0, size, SEGMENT_SIZE)] or [(0, 0)]
+        if self.workers <= 0:
+            snapshot = bytes(blocks)
+            futures = [loop.run_in_executor(None, compress_segment, snapshot, start, end, raw) for start, end in bounds]
+            return iter_chunks(futures, raw)
+        self.start()
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        futures = []
+        try:
+            shm.buf[:size] = blocks
+            for start, end in bounds:
+                futures.append(asyncio.wrap_future(
+                    self.executor.submit(compress_shared_segment, shm.name, size, start, end, raw), loop=loop))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            release(shm)
+            raise
+        # Also retrieves the errors of segments nobody waits for any more
+        asyncio.gather(*futures, return_exceptions=True).add_done_callback(lambda _: release(shm))
+        return iter_chunks(futures, raw)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+async def iter_chunks(futures, raw, chunk_size=1024):
+    """Cut the compressed segments into (data, percent) chunks, in order"""
+    pending = bytearray() if raw else bytearray(GZIP_HEADER)
+    for done, future in enumerate(futures, 1):
+        data, trailer = await future
+        pending += data
+        pending += trailer
+        percent = 100 if done == len(futures) else done * 100 // len(futures)
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size]), percent
+            del pending[:chunk_size]
+    if pending:
+        yield bytes(pending), 100
+
+def release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
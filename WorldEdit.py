@@ -0,0 +1,145 @@
+import math
+
+TRACK_VOLUME = 65536  # Edits touching more blocks than this are not diffed block by block
+
+class EditResult:
+    """Outcome of a bulk edit
+
+    changes is a list of (x, y, z, block id, old block id) for every block that changed,
+    or None when the edit was too large to track, in which case clients should get the
+    map again.
+    """
+    __slots__ = ('volume', 'changes', 'y_start', 'y_end')
+
+    def __init__(self, volume, changes, y_start, y_end):
+        self.volume = volume
+        self.changes = changes
+        self.y_start = y_start
+        self.y_end = y_end
+
+class Clipboard:
+    """Blocks copied out of a level, stored in the same XZY order as the level"""
+    __slots__ = ('width', 'height', 'depth', 'data')
+
+    def __init__(self, width, height, depth, data):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.data = data
+
+def clip_box(level, x0, y0, z0, x1, y1, z1):
+    """Order and clip an inclusive box to the level, returns half-open ranges or None"""
+    x0, x1 = max(0, min(x0, x1)), min(level.width, max(x0, x1) + 1)
+    y0, y1 = max(0, min(y0, y1)), min(level.height, max(y0, y1) + 1)
+    z0, z1 = max(0, min(z0, z1)), min(level.depth, max(z0, z1) + 1)
+    if x0 >= x1 or y0 >= y1 or z0 >= z1:
+        return None
+    return x0, y0, z0, x1, y1, z1
+
+def write_rows(level, rows, volume):
+    """Write (y, z, x, data) rows of blocks straight into the level's buffer
+
+    Rows that already hold the same blocks are skipped. Individual changes are only
+    collected when volume is at most TRACK_VOLUME.
+    """
+    blocks = level.blocks
+    width = level.width
+    layer = level.width * level.depth
+    changes = [] if volume <= TRACK_VOLUME else None
+    y_start = level.height
+    y_end = 0
+    changed = False
+    for y, z, x, data in rows:
+        start = x + z * width + y * layer
+        end = start + len(data)
+        if changes is not None:
+            old = blocks[start:end]
+            if old == data:
+                continue
+            for i, (before, after) in enumerate(zip(old, data)):
+                if before != after:
+                    changes.append((x + i, y, z, after, before))
+        elif blocks[start:end] == data:
+            continue
+        blocks[start:end] = data
+        changed = True
+        y_start = min(y_start, y)
+        y_end = max(y_end, y + 1)
+    if not changed:
+        return EditResult(volume, [], 0, 0)
+    return EditResult(volume, changes, y_start, y_end)
+
+def fill(level, x0, y0, z0, x1, y1, z1, block_id):
+    """Fill a cuboid (inclusive corners) with one block"""
+    box = clip_box(level, x0, y0, z0, x1, y1, z1)
+    if box is None:
+        return EditResult(0, [], 0, 0)
+    x0, y0, z0, x1, y1, z1 = box
+    row = bytes([block_id]) * (x1 - x0)
+    rows = ((y, z, x0, row) for y in range(y0, y1) for z in range(z0, z1))
+    return write_rows(level, rows, (x1 - x0) * (y1 - y0) * (z1 - z0))
+
+def replace(level, x0, y0, z0, x1, y1, z1, from_id, to_id):
+    """Replace one block type with another inside a cuboid"""
+    box = clip_box(level, x0, y0, z0, x1, y1, z1)
+    if box is None:
+        return EditResult(0, [], 0, 0)
+    x0, y0, z0, x1, y1, z1 = box
+    table = bytes.maketrans(bytes([from_id]), bytes([to_id]))
+    blocks = level.blocks
+    width = level.width
+    layer = level.width * level.depth
+
+    def rows():
+        for y in range(y0, y1):
+            for z in range(z0, z1):
+                start = x0 + z * width + y * layer
+                yield y, z, x0, bytes(blocks[start:start + x1 - x0]).translate(table)
+    return write_rows(level, rows(), (x1 - x0) * (y1 - y0) * (z1 - z0))
+
+def copy(level, x0, y0, z0, x1, y1, z1):
+    """Copy a cuboid into a Clipboard"""
+    box = clip_box(level, x0, y0, z0, x1, y1, z1)
+    if box is None:
+        return Clipboard(0, 0, 0, b'')
+    x0, y0, z0, x1, y1, z1 = box
+    blocks = level.blocks
+    width = level.width
+    layer = level.width * level.depth
+    data = b''.join(bytes(blocks[x0 + z * width + y * layer:x1 + z * width + y * layer])
+                    for y in range(y0, y1) for z in range(z0, z1))
+    return Clipboard(x1 - x0, y1 - y0, z1 - z0, data)
+
+def paste(level, clipboard, x, y, z):
+    """Paste a Clipboard with its minimum corner at (x, y, z), clipped to the level"""
+    box = clip_box(level, x, y, z, x + clipboard.width - 1, y + clipboard.height - 1, z + clipboard.depth - 1)
+    if box is None or not clipboard.data:
+        return EditResult(0, [], 0, 0)
+    x0, y0, z0, x1, y1, z1 = box
+    data = clipboard.data
+    width = clipboard.width
+    layer = clipboard.width * clipboard.depth
+
+    def rows():
+        for py in range(y0, y1):
+            for pz in range(z0, z1):
+                start = (x0 - x) + (pz - z) * width + (py - y) * layer
+                yield py, pz, x0, data[start:start + x1 - x0]
+    return write_rows(level, rows(), (x1 - x0) * (y1 - y0) * (z1 - z0))
+
+def sphere(level, cx, cy, cz, radius, block_id):
+    """Fill a solid sphere with one block"""
+    radius_sq = radius * radius
+
+    def rows():
+        for y in range(max(0, cy - radius), min(level.height, cy + radius + 1)):
+            for z in range(max(0, cz - radius), min(level.depth, cz + radius + 1)):
+                rest = radius_sq - (y - cy) ** 2 - (z - cz) ** 2
+                if rest < 0:
+                    continue
+                half = math.isqrt(rest)
+                x0 = max(0, cx - half)
+                x1 = min(level.width, cx + half + 1)
+                if x0 < x1:
+                    yield y, z, x0, bytes([block_id]) * (x1 - x0)
+    return write_rows(level, rows(), 4 * radius_sq * radius)
@@ -0,0 +1,5 @@
+"""Load generator and microbenchmarks for the server
+
+    python -m benchmark load --bots 50 --seconds 30
+    python -m benchmark micro
+"""
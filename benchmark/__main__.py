@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import load, micro
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Measure the server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bots = commands.add_parser("load", help="join headless bots to a server and report latencies")
+    bots.add_argument("--bots", type=int, default=20, help="number of bots (default 20)")
+    bots.add_argument("--seconds", type=float, default=10, help="how long the bots play (default 10)")
+    bots.add_argument("--port", type=int, default=25590, help="port of the scratch server (default 25590)")
+    bots.add_argument("--connect", metavar="HOST:PORT", help="use a running server instead of starting one")
+    bots.add_argument("--pid", type=int, help="process id of the --connect server, for its RSS")
+    bots.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                      help="server.properties override for the scratch server, repeatable")
+    bots.add_argument("--move-rate", type=float, default=10, help="position updates per bot per second")
+    bots.add_argument("--build-rate", type=float, default=0.5, help="block changes per bot per second")
+    bots.add_argument("--chat-rate", type=float, default=0.1, help="chat messages per bot per second")
+    bots.add_argument("--cpe", action="store_true", help="negotiate FastMap, BulkBlockUpdate and ExtEntityPositions")
+    bots.set_defaults(run=load.main)
+
+    levels = commands.add_parser("micro", help="time level encoding, saving, loading and generation")
+    levels.add_argument("--sizes", nargs="*", metavar="WxHxD", help="map sizes (default 64x64x64 to 512x64x512)")
+    levels.add_argument("--repeat", type=int, default=5, help="runs per measurement (default 5)")
+    levels.set_defaults(run=micro.main)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.run(args)
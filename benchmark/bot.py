@@ -0,0 +1,179 @@
+import asyncio
+import math
+import random
+import struct
+import time
+
+# Length of every server packet a vanilla client can receive, including the id
+SERVER_PACKET_SIZES = {
+    0x00: 131, 0x01: 1, 0x02: 1, 0x03: 1028, 0x04: 7, 0x06: 8, 0x07: 74, 0x08: 10,
+    0x09: 7, 0x0a: 5, 0x0b: 4, 0x0c: 2, 0x0d: 66, 0x0e: 65, 0x0f: 2,
+}
+MOVE_PACKETS = (0x08, 0x09, 0x0a)
+
+# CPE extensions a bot asks for with cpe=True, name -> version
+EXTENSIONS = {"FastMap": 1, "BulkBlockUpdate": 1, "ExtEntityPositions": 1}
+
+def pad(text):
+    return text.encode('ascii').ljust(64, b' ')
+
+class Stats:
+    """Measurements shared by every bot of a run"""
+    def __init__(self):
+        self.map_latencies = []  # Seconds from sending login to receiving Level Finalize
+        self.move_latencies = []  # Seconds from a bot sending a position to another bot seeing it
+        self.packets_in = 0
+        self.packets_out = 0
+        self.bytes_in = 0
+        self.sent_moves = {}  # (name, x, y, z) -> time the position was sent
+        self.errors = 0
+
+class Bot:
+    """Headless client that logs in, loads the map, then walks, builds and chats
+
+    It only parses what it needs to measure: Level Finalize for the join latency and
+    spawns and moves to reconstruct where the other bots are. With cpe it negotiates
+    the extensions the server offers out of EXTENSIONS.
+    """
+    def __init__(self, name, stats, host='127.0.0.1', port=25565, cpe=False):
+        self.name = name
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.cpe = cpe
+        self.extensions = set()
+        self.sizes = SERVER_PACKET_SIZES
+        self.coordinates = struct.Struct('>hhh')  # Absolute positions in spawns and teleports
+        self.reader = None
+        self.writer = None
+        self.names = {}  # Player id -> name, from spawn packets
+        self.positions = {}  # Player id -> [x, y, z] as this client sees it
+        self.spawn = None
+        self.size = None
+
+    async def connect(self):
+        """Log in and wait for the whole map"""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        start = time.perf_counter()
+        self.writer.write(b'\x00\x07' + pad(self.name) + pad('-') + (b'\x42' if self.cpe else b'\x00'))
+        await self.writer.drain()
+        self.stats.packets_out += 1
+        if self.cpe:
+            await self.negotiate()
+        buffer = b''
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("server closed the connection during login")
+            buffer += data
+            buffer, finalized = self.parse(buffer)
+            if finalized:
+                break
+        self.stats.map_latencies.append(time.perf_counter() - start)
+        return buffer
+
+    async def negotiate(self):
+        """Answer the server's ExtInfo and ExtEntry packets with the extensions both sides have"""
+        info = await self.reader.readexactly(67)
+        if info[0] != 0x10:
+            raise ValueError("server does not speak CPE")
+        offered = {}
+        for _ in range(struct.unpack_from('>h', info, 65)[0]):
+            entry = await self.reader.readexactly(69)
+            offered[entry[1:65].decode('ascii', 'ignore').rstrip()] = struct.unpack_from('>i', entry, 65)[0]
+        self.extensions = {name for name, version in EXTENSIONS.items() if offered.get(name) == version}
+        self.writer.write(b'\x10' + pad("bot") + struct.pack('>h', len(self.extensions)) +
+                          b''.join(b'\x11' + pad(name) + struct.pack('>i', EXTENSIONS[name]) for name in self.extensions))
+        await self.writer.drain()
+        self.stats.packets_out += 1 + len(self.extensions)
+        self.sizes = dict(SERVER_PACKET_SIZES)
+        self.sizes[0x26] = 1282
+        if "FastMap" in self.extensions:
+            self.sizes[0x02] = 5
+        if "ExtEntityPositions" in self.extensions:
+            self.sizes.update({0x07: 80, 0x08: 16})
+            self.coordinates = struct.Struct('>iii')
+
+    def parse(self, buffer):
+        """Handle every complete packet in buffer, returns the rest and whether the map finished"""
+        stats = self.stats
+        offset = 0
+        finalized = False
+        end = len(buffer)
+        sizes = self.sizes
+        while offset < end:
+            packet_id = buffer[offset]
+            size = sizes.get(packet_id)
+            if size is None:
+                raise ValueError(f"unknown packet 0x{packet_id:02x}")
+            if offset + size > end:
+                break
+            if packet_id == 0x04:
+                finalized = True
+                self.size = struct.unpack_from('>hhh', buffer, offset + 1)
+            elif packet_id == 0x08 and buffer[offset + 1] == 0xff:
+                self.spawn = list(self.coordinates.unpack_from(buffer, offset + 2))
+            elif packet_id == 0x07:
+                player_id = buffer[offset + 1]
+                self.names[player_id] = buffer[offset + 2:offset + 66].decode('ascii', 'ignore').rstrip()
+                self.positions[player_id] = list(self.coordinates.unpack_from(buffer, offset + 66))
+            elif packet_id in MOVE_PACKETS:
+                self.moved(packet_id, buffer, offset)
+            elif packet_id == 0x0c:
+                self.positions.pop(buffer[offset + 1], None)
+            stats.packets_in += 1
+            stats.bytes_in += size
+            offset += size
+        return buffer[offset:], finalized
+
+    def moved(self, packet_id, buffer, offset):
+        player_id = buffer[offset + 1]
+        position = self.positions.get(player_id)
+        if position is None:
+            return
+        if packet_id == 0x08:
+            position[:] = self.coordinates.unpack_from(buffer, offset + 2)
+        else:
+            dx, dy, dz = struct.unpack_from('>bbb', buffer, offset + 2)
+            position[0] += dx
+            position[1] += dy
+            position[2] += dz
+        sent = self.stats.sent_moves.get((self.names.get(player_id), *position))
+        if sent is not None:
+            self.stats.move_latencies.append(time.perf_counter() - sent)
+
+    async def read_forever(self, buffer=b''):
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                return
+            buffer, _ = self.parse(buffer + data)
+
+    async def act(self, seconds, move_rate=10, build_rate=0.5, chat_rate=0.1):
+        """Walk in a circle around the spawn, placing blocks and chatting now and then"""
+        x, y, z = self.spawn or (self.size[0] * 16, self.size[1] * 16, self.size[2] * 16)
+        angle = random.uniform(0, 6.283)
+        step = 0
+        interval = 1 / move_rate
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        while loop.time() < end:
+            await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+            step += 1
+            # A received move is matched to the latest send of the same position
+            px = x + int(64 * math.cos(angle + step * 0.05)) + step % 7
+            pz = z + int(64 * math.sin(angle + step * 0.05))
+            packets = [b'\x08\xff' + self.coordinates.pack(px, y, pz) + bytes((step & 0xff, 0))]
+            self.stats.sent_moves[(self.name, px, y, pz)] = time.perf_counter()
+            if random.random() < build_rate * interval:
+                bx, bz = px // 32, pz // 32
+                packets.append(b'\x05' + struct.pack('>hhhBB', bx, y // 32 - 2, bz, 1, random.choice((1, 4, 5))))
+            if random.random() < chat_rate * interval:
+                packets.append(b'\x0d\xff' + pad(f"step {step}"))
+            self.writer.write(b''.join(packets))
+            self.stats.packets_out += len(packets)
+            await self.writer.drain()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
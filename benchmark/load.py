@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from benchmark.bot import Bot, Stats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentiles(values, points=(50, 90, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {point: None for point in points}
+    return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+
+def rss(pid):
+    """Resident set size of a process in bytes, None where /proc is not available"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def write_properties(directory, overrides):
+    """Copy server.properties into directory with some values replaced"""
+    with open(os.path.join(ROOT, "server.properties")) as f:
+        lines = [line.rstrip('\r\n') for line in f]
+    remaining = dict(overrides)
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0]
+        if key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+    lines.extend(f"{key}={value}" for key, value in remaining.items())
+    with open(os.path.join(directory, "server.properties"), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def serve(directory, port):
+    """Process entry point, runs a server from a scratch directory so no real level is touched"""
+    os.chdir(directory)
+    sys.path.insert(0, ROOT)
+    with open("server.log", 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            import main
+            asyncio.run(main.MCSnake('127.0.0.1', port).start())
+        except KeyboardInterrupt:
+            pass
+
+def start_server(port, overrides):
+    """Start a local server in another process, returns (process, scratch directory)"""
+    directory = tempfile.mkdtemp(prefix="mcsnake-bench-")
+    write_properties(directory, {"public": "false", "host": "127.0.0.1", "port": port, **overrides})
+    # Not a daemon, the server starts its own encoder and gateway processes; stop_server ends it
+    process = multiprocessing.Process(target=serve, args=(directory, port))
+    process.start()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, directory
+        except OSError:
+            if not process.is_alive():
+                break
+            time.sleep(0.1)
+    stop_server(process, directory)
+    raise RuntimeError("benchmark server did not start")
+
+def stop_server(process, directory):
+    # Interrupted rather than terminated, so the server shuts its own processes down
+    os.kill(process.pid, signal.SIGINT)
+    process.join(10)
+    if process.is_alive():
+        process.terminate()
+        process.join(10)
+    shutil.rmtree(directory, ignore_errors=True)
+
+async def run_bots(count, seconds, host, port, pid=None, move_rate=10, build_rate=0.5, chat_rate=0.1, cpe=False):
+    """Join count bots at once, let them play for seconds and return the measurements"""
+    stats = Stats()
+    report = {"bots": count, "rss_idle": rss(pid) if pid else None}
+    bots = [Bot(f"bot{i}", stats, host, port, cpe) for i in range(count)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bot.connect() for bot in bots), return_exceptions=True)
+    report["join_seconds"] = time.perf_counter() - start
+    report["join_bytes"] = stats.bytes_in
+    joined = [(bot, rest) for bot, rest in zip(bots, results) if not isinstance(rest, BaseException)]
+    report["failed"] = count - len(joined)
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Bot failed to join: {result}")
+            break
+
+    # Steady state counters start once everyone is in
+    stats.packets_in = stats.packets_out = stats.bytes_in = 0
+    readers = [asyncio.create_task(bot.read_forever(rest)) for bot, rest in joined]
+    peak = [report["rss_idle"] or 0]
+
+    async def sample_rss():
+        while True:
+            await asyncio.sleep(0.5)
+            peak[0] = max(peak[0], rss(pid) or 0)
+    sampler = asyncio.create_task(sample_rss()) if pid else None
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bot.act(seconds, move_rate, build_rate, chat_rate) for bot, _ in joined), return_exceptions=True)
+    await asyncio.sleep(0.5)  # Let the last broadcasts arrive
+    elapsed = time.perf_counter() - start
+    for task in readers + ([sampler] if sampler else []):
+        task.cancel()
+    for bot in bots:
+        bot.close()
+
+    report.update({
+        "map_latency": percentiles(stats.map_latencies),
+        "move_latency": percentiles(stats.move_latencies),
+        "move_samples": len(stats.move_latencies),
+        "packets_in_per_second": stats.packets_in / elapsed,
+        "packets_out_per_second": stats.packets_out / elapsed,
+        "bytes_in_per_second": stats.bytes_in / elapsed,
+        "rss_peak": peak[0] or None,
+    })
+    return report
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f} ms"
+
+def format_mb(value):
+    return "-" if value is None else f"{value / 1048576:.1f} MB"
+
+def print_report(report):
+    print(f"Bots:           {report['bots'] - report['failed']} joined, {report['failed']} failed, "
+          f"all in after {report['join_seconds']:.2f} s, {format_mb(report['join_bytes'])} received")
+    for label, key in (("Login to map:", "map_latency"), ("Move broadcast:", "move_latency")):
+        print(f"{label:<16}" + ", ".join(f"p{point} {format_ms(value)}" for point, value in report[key].items()))
+    print(f"                ({report['move_samples']} moves seen by other bots)")
+    print(f"Packets:        {report['packets_in_per_second']:.0f}/s in, {report['packets_out_per_second']:.0f}/s out, "
+          f"{format_mb(report['bytes_in_per_second'])}/s received")
+    print(f"Server RSS:     {format_mb(report['rss_idle'])} idle, {format_mb(report['rss_peak'])} peak")
+
+def main(args):
+    overrides = dict(item.split('=', 1) for item in args.set)
+    process = directory = None
+    host, port, pid = '127.0.0.1', args.port, args.pid
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        port = int(port)
+    else:
+        process, directory = start_server(port, overrides)
+        pid = process.pid
+    try:
+        report = asyncio.run(run_bots(args.bots, args.seconds, host, port, pid,
+                                      args.move_rate, args.build_rate, args.chat_rate, args.cpe))
+    finally:
+        if process is not None:
+            stop_server(process, directory)
+    print_report(report)
+    return report
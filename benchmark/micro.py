@@ -0,0 +1,75 @@
+import contextlib
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import LevelTool
+import Terrain  # Registers the 'terrain' generator
+
+SIZES = ((64, 64, 64), (128, 64, 128), (256, 64, 256), (512, 64, 512))
+
+@contextlib.contextmanager
+def quiet():
+    """Mute the log lines the level code writes on every save and load"""
+    logger = logging.getLogger(LevelTool.__name__)
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+def measure(func, repeat):
+    """Best and median seconds of repeat calls, with the level code's logging muted"""
+    times = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+def benchmarks(level, directory):
+    """(name, function) pairs run against one level"""
+    path = os.path.join(directory, "bench.lvl")
+    data = level.format_level_data()
+    target = level.copy()
+    level.save_level(path)
+    return [
+        ("format_level_data", level.format_level_data),
+        ("parse_level_data", lambda: target.parse_level_data(data)),
+        ("save_level", lambda: level.save_level(path)),
+        ("save_level compressed", lambda: level.save_level(path + ".gz", compress=True)),
+        ("load_level", lambda: LevelTool.load_level(path)),
+        ("load_level mmap", lambda: LevelTool.load_level(path, use_mmap=True)),
+    ]
+
+def run(sizes=SIZES, repeat=5):
+    """Time the level code across map sizes, returns (name, size, best, median) rows"""
+    generators = ["flat"] + (["terrain"] if Terrain.np is not None else [])
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for width, height, depth in sizes:
+            size = f"{width}x{height}x{depth}"
+            for generator in generators:
+                best, median = measure(lambda: LevelTool.make_level(width, height, depth, LevelTool.get_generator(generator, 1)), repeat)
+                rows.append((f"make_level {generator}", size, best, median))
+                print_row(rows[-1])
+            with quiet():
+                level = LevelTool.make_level(width, height, depth, LevelTool.get_generator(generators[-1], 1))
+                tests = benchmarks(level, directory)
+            for name, func in tests:
+                best, median = measure(func, repeat)
+                rows.append((name, size, best, median))
+                print_row(rows[-1])
+    return rows
+
+def print_row(row):
+    name, size, best, median = row
+    print(f"{name:<24}{size:>12}  best {best * 1000:9.2f} ms  median {median * 1000:9.2f} ms")
+
+def main(args):
+    sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes] if args.sizes else SIZES
+    return run(sizes, args.repeat)
@@ -1,10 +1,301 @@
 import asyncio
+import logging
 import struct
 import LevelTool
+import Packets
+import Spatial
+import Heartbeat
+import WorldEdit
+import Journal
+import Plugins
+import Metrics
+import Log
+import Workers
+import Relay
+import Terrain  # Registers the 'terrain' generator
 import os
-from urllib.request import urlopen, Request
-from urllib.error import URLError
-from urllib.parse import quote
+import glob
+from collections import deque, OrderedDict
+
+log = logging.getLogger("mcsnake")
+
+metrics = Metrics.Registry()
+packets_in = metrics.counter("packets_in_total", "Packets received, by packet id", "id")
+packets_out = metrics.counter("packets_out_total", "Packets queued for clients, by packet id", "id")
+bytes_sent = metrics.counter("bytes_sent_total", "Bytes written to client sockets")
+map_send_seconds = metrics.summary("map_send_seconds", "Time to stream the map to one client")
+save_seconds = metrics.summary("save_seconds", "Time to write one world to disk")
+tick_seconds = metrics.summary("tick_seconds", "Time spent in one movement tick")
+loop_lag = metrics.gauge("event_loop_lag_seconds", "How late the event loop last woke a sleeping task")
+loop_lag_seconds = metrics.summary("event_loop_lag_summary_seconds", "Event loop wake up lateness")
+
+# CPE extensions the server speaks, name -> version
+EXTENSIONS = {"FastMap": 1, "BulkBlockUpdate": 1, "ExtEntityPositions": 1}
+# Packets a client may send before it is logged in
+LOGIN_PACKETS = (Packets.Login.ID, Packets.ExtInfo.ID, Packets.ExtEntry.ID)
+
+def chunk_packet(data, percent):
+    """Build a Level Data Chunk (0x03) packet"""
+    return (b'\x03' +
+            struct.pack('>h', len(data)) +  # Chunk length (before padding)
+            data.ljust(1024, b'\x00') +     # Chunk data (padded to 1024)
+            struct.pack('B', percent))      # Progress percentage
+
+class MapEncoding:
+    """Chunk packets of one level version, filled in as the encode pool produces them"""
+    def __init__(self, version):
+        self.version = version
+        self.packets = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = None
+
+    async def stream(self):
+        """Yield every packet, waiting for the ones not compressed yet"""
+        sent = 0
+        while True:
+            if sent < len(self.packets):
+                yield self.packets[sent]
+                sent += 1
+            elif self.done:
+                break
+            else:
+                self.changed.clear()
+                await self.changed.wait()
+        if self.error is not None:
+            raise self.error
+
+class MapCache:
+    """Compressed map chunk packets, kept until the level version changes
+
+    Compression runs in the encode pool and its chunks are streamed to the joiner as
+    they come out. Joiners that arrive while a version is being compressed follow the
+    same encoding instead of compressing it again. With raw the chunks are the FastMap
+    encoding.
+    """
+    def __init__(self, level, pool, raw=False):
+        self.level = level
+        self.pool = pool
+        self.raw = raw
+        self.version = None
+        self.packets = None
+        self.pending = None  # MapEncoding being compressed
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, version, packets):
+        if self.version is None or version >= self.version:
+            self.version = version
+            self.packets = packets
+
+    async def stream(self):
+        """Yield the chunk packets of the current level version"""
+        version = self.level.version
+        if self.packets is not None and self.version == version:
+            self.hits += 1
+            for packet in self.packets:
+                yield packet
+            return
+        self.misses += 1
+        if self.pending is None or self.pending.version != version:
+            # The snapshot is taken right here, so it matches version. The task is
+            # independent of this joiner, one that disconnects does not stop it.
+            self.pending = MapEncoding(version)
+            self.pending.task = asyncio.create_task(
+                self.compress(self.pending, self.pool.level_chunks(self.level.blocks, self.raw)))
+        async for packet in self.pending.stream():
+            yield packet
+
+    async def get(self):
+        """Every chunk packet of the current level version"""
+        return [packet async for packet in self.stream()]
+
+    async def compress(self, encoding, chunks):
+        try:
+            async for data, percent in chunks:
+                encoding.packets.append(chunk_packet(data, percent))
+                encoding.changed.set()
+            self.store(encoding.version, encoding.packets)
+        except Exception as e:
+            log.error("Error compressing the map: %s", e)
+            encoding.error = e
+        finally:
+            encoding.done = True
+            encoding.changed.set()
+            if self.pending is encoding:
+                self.pending = None
+
+class Connection:
+    """State of one connected client and its outbound queue
+
+    Broadcasts only enqueue, a per-connection sender task writes the queue out with
+    drain() so a stalled client never blocks the others. Position updates are
+    coalesced per player, and a client whose queue stays above
+    send_queue_limit for slow_client_timeout seconds is disconnected.
+    """
+    __slots__ = ('address', 'reader', 'writer', 'user', 'queue', 'moves', 'queued_bytes',
+                 'over_since', 'wake', 'sender', 'ready', 'closed', 'visible', 'deferred',
+                 'map_pending', 'resend_map', 'world', 'extensions', 'client_packets',
+                 'login', 'ext_remaining')
+
+    def __init__(self, reader, writer):
+        self.address = writer.get_extra_info('peername')
+        self.reader = reader
+        self.writer = writer
+        self.user = None
+        self.queue = deque()
+        self.moves = {}  # Player id -> latest queued position packet
+        self.queued_bytes = 0
+        self.over_since = None  # Loop time the queue first went over the limit
+        self.wake = asyncio.Event()
+        self.sender = None
+        self.ready = False  # Map sent and other players spawned, movement may be sent
+        self.closed = False
+        self.visible = set()  # Ids of the players spawned on this client
+        self.deferred = {}  # Grid cell -> {(x, y, z): block id} changes held back while out of range
+        self.map_pending = False
+        self.resend_map = None  # Coroutine function(connection) that sends the whole map again
+        self.world = None  # World the player is in
+        self.extensions = set()  # CPE extensions both sides support
+        self.client_packets = Packets.CLIENT_PACKETS  # Layout of the packets this client sends
+        self.login = None  # Login packet while extensions are being negotiated
+        self.ext_remaining = None  # ExtEntry packets the client still has to send
+
+    def send(self, packet):
+        """Queue a packet for this client"""
+        if self.closed:
+            return
+        self.queue.append(packet)
+        self.queued_bytes += len(packet)
+        # Buffers only ever hold packets of one kind
+        packets_out.inc(packet[0], len(packet) // Packets.SERVER_PACKET_SIZES[packet[0]])
+        self.check_backlog()
+        self.wake.set()
+
+    def send_move(self, player_id, packet, absolute):
+        """Queue a movement packet for a player
+
+        If an older one for the same player has not been written yet, both are replaced
+        by the absolute position since a relative move only makes sense after the last.
+        """
+        if self.closed:
+            return
+        previous = self.moves.get(player_id)
+        if previous is not None:
+            self.queued_bytes -= len(previous)
+            packet = absolute
+        self.moves[player_id] = packet
+        self.queued_bytes += len(packet)
+        packets_out.inc(packet[0])
+        self.check_backlog()
+        self.wake.set()
+
+    def drop_move(self, player_id):
+        previous = self.moves.pop(player_id, None)
+        if previous is not None:
+            self.queued_bytes -= len(previous)
+
+    def check_backlog(self):
+        if self.queued_bytes <= send_queue_limit:
+            return
+        now = asyncio.get_running_loop().time()
+        if self.over_since is None:
+            self.over_since = now
+        elif now - self.over_since > slow_client_timeout or self.queued_bytes > send_queue_limit * 4:
+            self.evict(f"send queue over limit ({self.queued_bytes} bytes)")
+
+    def evict(self, reason):
+        """Drop the connection without waiting for buffered data, the read loop cleans up"""
+        if self.closed:
+            return
+        log.warning("Disconnecting %s: %s", self.address, reason)
+        self.closed = True
+        self.queue.clear()
+        self.moves.clear()
+        self.queued_bytes = 0
+        self.writer.transport.abort()
+
+    def request_map(self):
+        """Send the whole map again once everything queued so far has been written"""
+        self.map_pending = True
+        self.wake.set()
+
+    def start_sender(self):
+        self.ready = True
+        self.sender = asyncio.create_task(self.run_sender())
+
+    async def run_sender(self):
+        writer = self.writer
+        try:
+            while not self.closed:
+                await self.wake.wait()
+                self.wake.clear()
+                while self.queue or self.moves or self.map_pending:
+                    if not self.queue and not self.moves:
+                        self.map_pending = False
+                        await self.resend_map(self)
+                        continue
+                    batch = list(self.queue)
+                    self.queue.clear()
+                    if self.moves:
+                        batch.extend(self.moves.values())
+                        self.moves.clear()
+                    self.queued_bytes = 0
+                    data = b''.join(batch)
+                    bytes_sent.inc(amount=len(data))
+                    writer.write(data)
+                    await writer.drain()
+                    if self.queued_bytes <= send_queue_limit:
+                        self.over_since = None
+        except (ConnectionError, OSError) as e:
+            self.evict(f"send failed: {e}")
+
+class World:
+    """A named level with its own players, interest grid, journal and map cache
+
+    The level is only in memory while the world is loaded. Worlds other than the hub
+    are loaded when the first player enters and unloaded once they have been empty for
+    a while, see MCSnake.load_world and MCSnake.unload_idle_worlds.
+    """
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.level = None
+        self.journal = None
+        self.map_cache = None
+        self.fast_map_cache = None  # For FastMap clients
+        self.grid = Spatial.SpatialGrid(view_distance)
+        self.players = {}  # Player id -> Connection of every player in this world
+        self.save_lock = asyncio.Lock()  # Keeps background saves in order
+        self.load_lock = asyncio.Lock()
+        self.empty_since = None  # Loop time the last player left, None while occupied
+        self.pinned = False  # Never unloaded
+
+    def open(self, journal):
+        """Read the level and replay its journal, or generate it, blocking"""
+        if os.path.isfile(self.filename):
+            return LevelTool.load_level(self.filename, journal=journal)
+        journal.discard()  # Changes to a level that no longer exists
+        level = LevelTool.make_level(128, 64, 128, LevelTool.get_generator(generator, seed))
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        level.save_level(self.filename)
+        return level
+
+    def attach(self, level, journal, pool):
+        self.level = level
+        self.journal = journal
+        self.map_cache = MapCache(level, pool)
+        self.fast_map_cache = MapCache(level, pool, raw=True)
+
+    def detach(self):
+        self.level = None
+        self.journal = None
+        self.map_cache = None
+        self.fast_map_cache = None
+
+    def map_cache_for(self, conn):
+        return self.fast_map_cache if "FastMap" in conn.extensions else self.map_cache
 
 class MCSnake:
     def __init__(self, host='127.0.0.1', port=25565):
@@ -14,292 +305,757 @@ class MCSnake:
         self.ids = 1
         self.users = []
         self.chat = []
-        self.writers = set()
+        self.connections = set()
+        self.positions = {}  # Player id -> last broadcast (x, y, z, yaw, pitch)
+        self.players = {}  # Player id -> Connection, in every world
+        self.pending_moves = {}  # Player id -> latest position received since the last tick
+        self.tick_task = None
         self.player_count = 0
         self.salt = os.urandom(16).hex()
-        if os.path.isfile("main.lvl"):
-            self.level = LevelTool.load_level("main.lvl")
-        else:
-            self.level = LevelTool.make_level(128, 64, 128)
-            self.level.save_level("main.lvl")
 
+        # The hub is main.lvl, other worlds live in worlds/ or are listed in server.properties
+        self.worlds = {"main": World("main", "main.lvl")}
+        for filename in sorted(glob.glob(os.path.join("worlds", "*.lvl"))):
+            world_name = os.path.basename(filename)[:-4]
+            self.worlds.setdefault(world_name, World(world_name, filename))
+        for world_name in world_names:
+            self.worlds.setdefault(world_name, World(world_name, os.path.join("worlds", world_name + ".lvl")))
+        self.loaded = OrderedDict()  # Name -> loaded World, least recently entered first
+        self.encode_pool = Workers.EncodePool(encode_workers)
+        self.gateways = []  # Networking processes sharing the port
+        self.hub = self.worlds["main"]
+        self.hub.pinned = True
+        journal = Journal.Journal(self.hub.filename + ".journal", journal_flush_interval)
+        self.hub.attach(self.hub.open(journal), journal, self.encode_pool)
+        self.loaded[self.hub.name] = self.hub
+        self.autosave_task = None
+
+        self.heartbeat = Heartbeat.Heartbeat(heartbeat_url, name, self.port, self.salt, interval=heartbeat_interval)
         self.heartbeat_task = None  # Store task reference
+        # Packet id -> handler(connection, packet), handlers may return an awaitable
+        self.handlers = {
+            Packets.Login.ID: self.handle_login,
+            Packets.Message.ID: self.handle_message,
+            Packets.SetBlock.ID: self.handle_set_block,
+            Packets.Position.ID: self.handle_position,
+            Packets.ExtInfo.ID: self.handle_ext_info,
+            Packets.ExtEntry.ID: self.handle_ext_entry,
+        }
         self.public = public  # Store public flag
+        self.plugins = Plugins.PluginManager(self, "plugins", plugin_threads)
+        self.profiler = Metrics.Profiler()
+        self.lag_task = None
+        self.background = set()  # Fire and forget tasks, referenced until they finish
+        metrics.gauge("players", "Players logged in", lambda: len(self.players))
+        metrics.gauge("connections", "Open client connections", lambda: len(self.connections))
+        metrics.gauge("worlds_loaded", "Worlds in memory", lambda: len(self.loaded))
+        metrics.gauge("send_queue_bytes", "Bytes queued for all clients", lambda: sum(conn.queued_bytes for conn in self.connections))
+        metrics.gauge("send_queue_max_bytes", "Bytes queued for the most backed up client",
+                      lambda: max((conn.queued_bytes for conn in self.connections), default=0))
 
-    async def broadcast_online_periodically(self):
+    async def save_world(self, world):
+        """Save the changes to a world's level in a worker thread"""
+        async with world.save_lock:
+            if world.level is None:
+                return
+            level = world.level
+            journal = world.journal
+            try:
+                # Journal segments sealed here are covered by the snapshot taken right after
+                sealed = await journal.begin_save()
+            except OSError as e:
+                log.error("Error writing journal before saving %s: %s", world.filename, e)
+                return
+            job = level.prepare_save(world.filename)
+            if job is not None:
+                regions, write = job
+                try:
+                    with save_seconds.time():
+                        await asyncio.get_running_loop().run_in_executor(None, write)
+                except Exception as e:
+                    log.error("Error saving %s: %s", world.filename, e)
+                    level.restore_dirty(regions)
+                    return
+            try:
+                await journal.end_save(sealed)
+            except OSError as e:
+                # The segments stay sealed and are deleted by the next save
+                log.error("Error removing journal segments of %s: %s", world.filename, e)
+
+    async def save_level(self):
+        """Save every loaded world"""
+        for world in list(self.loaded.values()):
+            await self.save_world(world)
+
+    async def autosave_periodically(self):
         while True:
-            self.broadcast_online()
-            await asyncio.sleep(120)
+            await asyncio.sleep(autosave_interval)
+            try:
+                await self.save_level()
+                await self.unload_idle_worlds()
+            except Exception as e:
+                log.error("Error in autosave: %s", e)
 
-    def broadcast_online(self):
-        try:
-            # Encode individual parameters, not the whole URL
-            encoded_name = quote(name)
-            url = f"http://www.classicube.net/server/heartbeat/?name={encoded_name}&port={self.port}&users={self.player_count}&max=100&salt={self.salt}&public=true&web=false&software=MCSnake"
-            req = Request(url)
-            with urlopen(req) as response:
-                print(response.read().decode('utf-8'))
-        except URLError as e:
-            print(f"Error making request: {e}")
+    def start_journal(self, world):
+        world.journal.flush_task = asyncio.create_task(world.journal.flush_periodically())
+
+    async def load_world(self, world):
+        """Load a world's level in a worker thread unless it is in memory already"""
+        async with world.load_lock:
+            if world.level is not None:
+                return world
+            loop = asyncio.get_running_loop()
+            journal = Journal.Journal(world.filename + ".journal", journal_flush_interval)
+            level = await loop.run_in_executor(None, world.open, journal)
+            world.attach(level, journal, self.encode_pool)
+            self.start_journal(world)
+            world.empty_since = loop.time()
+            self.loaded[world.name] = world
+            log.info("Loaded world %s", world.name)
+        if len(self.loaded) > max_loaded_worlds:
+            self.run_in_background(self.unload_idle_worlds())
+        return world
+
+    async def unload_world(self, world):
+        """Save an empty world and drop its level, False if it has to stay loaded"""
+        await self.save_world(world)
+        # Someone entered, something changed or the save failed while it was saving
+        if world.level is None or world.players or world.level.dirty_regions or world.journal.buffer or world.journal.sealed:
+            return False
+        world.journal.flush_task.cancel()
+        world.detach()
+        del self.loaded[world.name]
+        log.info("Unloaded world %s", world.name)
+        return True
+
+    async def unload_idle_worlds(self):
+        """Unload worlds that have been empty for world_idle_timeout seconds
+
+        While more than max_loaded_worlds are loaded, the least recently entered empty
+        worlds go first regardless of how long they have been empty.
+        """
+        now = asyncio.get_running_loop().time()
+        excess = len(self.loaded) - max_loaded_worlds
+        for world in list(self.loaded.values()):
+            if world.pinned or world.players or world.empty_since is None:
+                continue
+            if excess > 0 or now - world.empty_since >= world_idle_timeout:
+                if await self.unload_world(world):
+                    excess -= 1
+
+    def run_in_background(self, coro):
+        """Start a task nobody awaits, kept alive until it is done and its failure logged"""
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background_done)
+        return task
+
+    def background_done(self, task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error in %s: %s", task.get_coro().__qualname__, task.exception())
+
+    async def broadcast_online_periodically(self):
+        await self.heartbeat.run(lambda: self.player_count)
+
+    async def broadcast_online(self):
+        """Send a single heartbeat"""
+        return await self.heartbeat.send(self.player_count)
 
     def decode_packet(self, data):
-        packet_id = data[0]
-        payload = data[1:]
-        try:
-            if packet_id == 0x00:
-                return {"packet": packet_id, "ver": payload[0], "username": payload[1:64].decode('ascii').strip(' '), "verification": payload[65:128].decode('ascii').strip(' ')}
-            elif packet_id == 0x0d:
-                return {"packet": packet_id, "message": payload[1:].decode('ascii').strip(' ')}
-            elif packet_id == 0x05:
-                x, y, z, mode, block_id = struct.unpack('>hhhBB', payload)
-                return {"packet": packet_id, "x": x, "y": y, "z": z, "mode": mode, "block_id": block_id}
-            elif packet_id == 0x08:
-                player_id, x, y, z, yaw, pitch = struct.unpack('>BhhhBB', payload)
-                return {"packet": packet_id, "x": x, "y": y, "z": z, "yaw": yaw, "pitch": pitch}
-            return None
-        except struct.error as e:
-            print(f"Error decoding packet: {e}")
-            return None
+        """Decode a single client packet into its Packets object, None if unknown"""
+        return Packets.decode(data)
     
-    def block_update(self, x, y, z, block_id):
-        self.level.modify_block(x, y, z, block_id)
-        for writer in self.writers:
-            try:
-                writer.write(b'\x06' + struct.pack('>h', x) + struct.pack('>h', y) + struct.pack('>h', z) + struct.pack('B', block_id))
-            except Exception as e:
-                print(f"Error sending block update: {e}")
-                raise
+    def broadcast(self, packet):
+        """Queue a packet for every connected client"""
+        for conn in self.connections:
+            conn.send(packet)
+
+    def block_update(self, x, y, z, block_id, username='', world=None):
+        """Change one block in a world, the hub by default"""
+        world = world or self.hub
+        level = world.level
+        if level.in_bounds(x, y, z):
+            world.journal.log(x, y, z, level.get_block(x, y, z), block_id, username)
+        level.modify_block(x, y, z, block_id)
+        self.send_block_changes(world, [(x, y, z, block_id)])
+
+    def send_block_changes(self, world, changes):
+        """Send (x, y, z, block id, ...) changes as one buffer per client in the world
+
+        Each distinct encoding is built once, for the first client that needs it.
+        """
+        grid = world.grid
+        level = world.level
+        encoded = {}  # (cell, bulk) -> packets
+
+        def packets_for(conn, cell, cell_changes):
+            bulk = len(cell_changes) >= Packets.BULK_MIN_CHANGES and "BulkBlockUpdate" in conn.extensions
+            packets = encoded.get((cell, bulk))
+            if packets is None:
+                packets = encoded[cell, bulk] = self.block_change_packets(conn, cell_changes, level)
+            return packets
+
+        if grid.unlimited:
+            for conn in world.players.values():
+                conn.send(packets_for(conn, None, changes))
+            return
+
+        # Players out of range get the changes once they come near them
+        by_cell = {}
+        for change in changes:
+            by_cell.setdefault(grid.cell_of(change[0], change[2]), []).append(change)
+        for conn in world.players.values():
+            if not conn.ready:
+                conn.send(packets_for(conn, None, changes))
+                continue
+            here = grid.where[conn.user["id"]]
+            for cell, cell_changes in by_cell.items():
+                if grid.near_cells(here, cell):
+                    conn.send(packets_for(conn, cell, cell_changes))
+                else:
+                    deferred = conn.deferred.setdefault(cell, {})
+                    for change in cell_changes:
+                        deferred[change[:3]] = change[3]
+
+    def block_change_packets(self, conn, changes, level):
+        """0x06 packets for a client, or BulkBlockUpdate packets if it has them and they are smaller"""
+        if len(changes) >= Packets.BULK_MIN_CHANGES and "BulkBlockUpdate" in conn.extensions:
+            return Packets.bulk_block_packets(changes, level.width, level.depth)
+        return Packets.block_change_packets(changes)
+
+    def apply_edit(self, world, result, username=''):
+        """Journal and publish a WorldEdit result, small edits as block changes, large ones as a map resend"""
+        if result.changes == []:
+            return result
+        world.level.touch(result.y_start, result.y_end)
+        if result.changes is not None:
+            world.journal.log_many(result.changes, username)
+        else:
+            # Too large to journal, save it instead
+            self.run_in_background(self.save_world(world))
+        if result.changes is not None and len(result.changes) <= edit_batch_limit:
+            self.send_block_changes(world, result.changes)
+        else:
+            self.run_in_background(self.resend_map_all(world))
+        return result
+
+    def undo(self, username, x0, y0, z0, x1, y1, z1, world=None):
+        """Revert a player's changes inside an inclusive box, skipping blocks changed since by others"""
+        world = world or self.hub
+        level = world.level
+        changes = []
+        for x, y, z, old_id, new_id in world.journal.find(username, x0, y0, z0, x1, y1, z1):
+            # Newest first, so a chain of edits to one block unwinds back to the oldest
+            if level.get_block(x, y, z) == new_id:
+                level.blocks[level.index(x, y, z)] = old_id
+                changes.append((x, y, z, old_id, new_id))
+        if not changes:
+            return WorldEdit.EditResult(0, [], 0, 0)
+        ys = [change[1] for change in changes]
+        return self.apply_edit(world, WorldEdit.EditResult(len(changes), changes, min(ys), max(ys) + 1))
+
+    async def resend_map_all(self, world):
+        """Compress the map once and send it again to every player in the world"""
+        for map_cache in {world.map_cache_for(conn) for conn in world.players.values()}:
+            await map_cache.get()
+        for conn in world.players.values():
+            conn.deferred.clear()
+            conn.request_map()
+
+    async def resend_map(self, conn):
+        """Sent from the connection's sender task, keeps the player where it is"""
+        world = conn.world
+        await self.send_map(conn, world, self.positions.get(conn.user["id"]))
+        if conn.world is not world:
+            return  # Moved on again while the map was streaming, that world's map is pending
+        if not conn.ready:
+            # Arrived from another world
+            conn.ready = True
+            self.send_players(conn)
+            return
+        # Loading a level removes every entity, spawn the visible players again
+        for other in conn.visible:
+            # A relative move queued against the old entity would land after the spawn
+            conn.drop_move(other)
+            conn.send(self.spawn_packet(other, conn))
+
+    def fill(self, x0, y0, z0, x1, y1, z1, block_id, world=None):
+        world = world or self.hub
+        return self.apply_edit(world, WorldEdit.fill(world.level, x0, y0, z0, x1, y1, z1, block_id))
+
+    def replace(self, x0, y0, z0, x1, y1, z1, from_id, to_id, world=None):
+        world = world or self.hub
+        return self.apply_edit(world, WorldEdit.replace(world.level, x0, y0, z0, x1, y1, z1, from_id, to_id))
+
+    def copy(self, x0, y0, z0, x1, y1, z1, world=None):
+        world = world or self.hub
+        return WorldEdit.copy(world.level, x0, y0, z0, x1, y1, z1)
+
+    def paste(self, clipboard, x, y, z, world=None):
+        world = world or self.hub
+        return self.apply_edit(world, WorldEdit.paste(world.level, clipboard, x, y, z))
+
+    def sphere(self, x, y, z, radius, block_id, world=None):
+        world = world or self.hub
+        return self.apply_edit(world, WorldEdit.sphere(world.level, x, y, z, radius, block_id))
+
+    def send_deferred_blocks(self, conn):
+        """Send the held back block changes that are now in range of a player"""
+        grid = conn.world.grid
+        here = grid.where[conn.user["id"]]
+        for cell in [cell for cell in conn.deferred if grid.near_cells(here, cell)]:
+            changes = [(x, y, z, block_id) for (x, y, z), block_id in conn.deferred.pop(cell).items()]
+            conn.send(self.block_change_packets(conn, changes, conn.world.level))
     
-    def send_map(self, to_send):
-        """Format and send level data in chunks"""
+    async def send_map(self, conn, world, position=None):
+        """Stream a world's level data to a client in chunks, then place it at position (spawn by default)"""
+        writer = conn.writer
+        level = world.level
+        map_cache = world.map_cache_for(conn)
+        start = asyncio.get_running_loop().time()
+        sent = 0
         try:
 
-            # Send Level Initialize (0x02)
-            to_send.append(b'\x02')
+            # Send Level Initialize (0x02), FastMap clients get the map volume with it
+            if map_cache.raw:
+                writer.write(b'\x02' + struct.pack('>i', len(level.blocks)))
+            else:
+                writer.write(b'\x02')
             
-            # Format and compress level data
-            compressed_data = self.level.format_level_data()
-            chunks = self.level.get_chunks(compressed_data)
-            
-            print(f"Sending {len(chunks)} chunks...")
-            
-            # Send chunks
-            for i, chunk in enumerate(chunks):
-                # Send Level Data Chunk (0x03)
-                packet = (b'\x03' + 
-                        struct.pack('>h', chunk['length']) +  # Chunk length (before padding)
-                        chunk['data'] +                       # Chunk data (padded to 1024)
-                        struct.pack('B', chunk['percent']))   # Progress percentage
-                to_send.append(packet)
-                print(f"Added chunk {i+1}/{len(chunks)} ({chunk['percent']}%)")
+            # Compressed chunks are shared by every joiner until the level changes, edits
+            # made after the snapshot reach this client as block changes once it is done
+            async for packet in map_cache.stream():
+                writer.write(packet)
+                sent += 1
+                await writer.drain()
+            log.debug("Sent %d chunks (map cache: %d hits, %d misses)", sent, map_cache.hits, map_cache.misses)
 
             # Send Level Finalize (0x04)
-            packet = (b'\x04' + 
-                    struct.pack('>h', self.level.width) +
-                    struct.pack('>h', self.level.height) +
-                    struct.pack('>h', self.level.depth))
-            to_send.append(packet)
-            print("Map data prepared successfully")
+            writer.write(b'\x04' + 
+                    struct.pack('>h', level.width) +
+                    struct.pack('>h', level.height) +
+                    struct.pack('>h', level.depth))
             
-            to_send.append(b'\x08' + struct.pack('b', -1) + struct.pack('>h', self.level.xSpawn*32) + struct.pack('>h', self.level.ySpawn*32) + struct.pack('>h', self.level.zSpawn*32) + b'\x00' + b'\x00')
-
-            return to_send
+            if position is None:
+                position = (level.xSpawn*32, level.ySpawn*32, level.zSpawn*32, 0, 0)
+            writer.write(Packets.teleport_packet(-1, position, "ExtEntityPositions" in conn.extensions))
+            await writer.drain()
+            map_send_seconds.observe(asyncio.get_running_loop().time() - start)
+            log.debug("Map data sent successfully")
         except Exception as e:
-            print(f"Error in send_map: {e}")
-            return to_send
+            log.error("Error in send_map: %s", e)
+        finally:
+            packets_out.inc(0x03, sent)
+            bytes_sent.inc(amount=sent * Packets.SERVER_PACKET_SIZES[0x03])
 
     def format_string(self, string):
         return string.encode('ascii').ljust(64, b'\x20')
     
     def send_chat(self):
         """Send chat messages to all clients"""
-        for writer in self.writers:
-            try:
-                for message in self.chat:
-                    writer.write(message)
-            except Exception as e:
-                print(f"Error sending chat message: {e}")
-                raise
+        for message in self.chat:
+            self.broadcast(message)
         self.chat.clear()
 
-    def create_player(self, user_id, username):
-        """Send chat messages to all clients"""
-        for writer in self.writers:
-            try:
-                writer.write(b'\x07' + struct.pack('b', user_id) + self.format_string(username) + struct.pack('>h', self.level.xSpawn*32) + struct.pack('>h', self.level.ySpawn*32) + struct.pack('>h', self.level.zSpawn*32) + b'\x00' + b'\x00')
-            except Exception as e:
-                print(f"Error creating player: {e}")
-                raise
+    def spawn_packet(self, user_id, conn):
+        """Spawn packet of a player for the client conn"""
+        position = self.positions[user_id]
+        if "ExtEntityPositions" in conn.extensions:
+            position = struct.pack('>iiiBB', *position)
+        else:
+            position = struct.pack('>hhhBB', *Packets.short_position(position))
+        return b'\x07' + struct.pack('b', user_id) + self.format_string(self.players[user_id].user["username"]) + position
 
-    def send_players(self, to_send, player_user):
-        """Send chat messages to all clients"""
-        for user in self.users:
-            try:
-                if not user == player_user:
-                    to_send.append(b'\x07' + struct.pack('b', user["id"]) + self.format_string(user["username"]) + struct.pack('>h', self.level.xSpawn*32) + struct.pack('>h', self.level.ySpawn*32) + struct.pack('>h', self.level.zSpawn*32) + b'\x00' + b'\x00')
-            except Exception as e:
-                print(f"Error sending players: {e}")
-                raise
-        return to_send
+    def send_message(self, conn, message):
+        """Send a chat line to one client"""
+        conn.send(b'\x0d' + struct.pack('>b', 0) + self.format_string(message[:64]))
+
+    def enter_world(self, conn, world):
+        """Place a player at a world's spawn point, it is shown to others once its map is loaded"""
+        user_id = conn.user["id"]
+        level = world.level
+        conn.world = world
+        world.players[user_id] = conn
+        world.empty_since = None
+        self.loaded.move_to_end(world.name)
+        position = (level.xSpawn*32, level.ySpawn*32, level.zSpawn*32, 0, 0)
+        self.positions[user_id] = position
+        world.grid.insert(user_id, position[0] // 32, position[2] // 32)
+
+    def leave_world(self, conn):
+        """Take a player out of its world and despawn it for the clients that can see it"""
+        world = conn.world
+        user_id = conn.user["id"]
+        self.pending_moves.pop(user_id, None)
+        world.grid.remove(user_id)
+        world.players.pop(user_id, None)
+        if not world.players:
+            world.empty_since = asyncio.get_running_loop().time()
+        packet = b'\x0c' + struct.pack('b', user_id)
+        for other in conn.visible:
+            other_conn = self.players.get(other)
+            if other_conn is not None:
+                other_conn.visible.discard(user_id)
+                other_conn.drop_move(user_id)
+                other_conn.send(packet)
+            conn.drop_move(other)
+        conn.visible.clear()
+        conn.deferred.clear()
+
+    async def change_world(self, conn, world_name):
+        """Move a player to the spawn of another world, loading it if needed"""
+        world = self.worlds.get(world_name)
+        if world is None:
+            self.send_message(conn, f"There is no world called {world_name}")
+            return
+        if world is conn.world:
+            return
+        try:
+            await self.load_world(world)
+        except Exception as e:
+            log.error("Error loading world %s: %s", world_name, e)
+            self.send_message(conn, f"Could not load {world_name}")
+            return
+        if conn.closed or world is conn.world:
+            return
+        self.leave_world(conn)
+        self.enter_world(conn, world)
+        # The sender streams the new map once the old world's packets are out
+        conn.ready = False
+        conn.request_map()
+
+    def send_players(self, conn):
+        """Spawn the players in range of a client that just joined, and it for them"""
+        self.update_interest(conn, set())
+
+    def update_interest(self, conn, fresh):
+        """Spawn and despawn players as they enter and leave a player's view radius
+
+        Visibility is symmetric, so both sides are updated. Pairs spawned here are added
+        to fresh, they already got each other's current position.
+        """
+        user_id = conn.user["id"]
+        players = self.players
+        near = {other for other in conn.world.grid.query(user_id) if players[other].ready}
+        for other in near - conn.visible:
+            other_conn = players[other]
+            conn.visible.add(other)
+            other_conn.visible.add(user_id)
+            conn.send(self.spawn_packet(other, conn))
+            other_conn.send(self.spawn_packet(user_id, other_conn))
+            fresh.add((user_id, other))
+            fresh.add((other, user_id))
+        for other in conn.visible - near:
+            other_conn = players[other]
+            conn.visible.discard(other)
+            other_conn.visible.discard(user_id)
+            conn.drop_move(other)
+            other_conn.drop_move(user_id)
+            conn.send(b'\x0c' + struct.pack('b', other))
+            other_conn.send(b'\x0c' + struct.pack('b', user_id))
 
     def delete_player(self, user_id):
-        """Send chat messages to all clients"""
-        for writer in self.writers:
-            try:
-                writer.write(b'\x0c' + struct.pack('b', user_id))
-            except Exception as e:
-                print(f"Error deleting player: {e}")
-                raise
+        """Take a player that disconnected out of its world"""
+        conn = self.players.pop(user_id, None)
+        if conn is not None and conn.world is not None:
+            self.leave_world(conn)
+        self.positions.pop(user_id, None)
 
     def move_player(self, user_id, x, y, z, yaw, pitch):
-        """Send chat messages to all clients"""
-        for writer in self.writers:
+        """Record a player's position, it is sent to the other clients on the next tick"""
+        self.pending_moves[user_id] = (x, y, z, yaw, pitch)
+
+    def tick(self):
+        """Broadcast the latest position of every player that moved since the last tick"""
+        if self.plugins.on_tick:
+            self.plugins.dispatch(self.plugins.on_tick)
+        if not self.pending_moves:
+            return
+        moved = []
+        players = self.players
+        try:
+            for user_id, position in self.pending_moves.items():
+                old = self.positions.get(user_id)
+                if old is None:
+                    continue
+                packet = Packets.move_packet(user_id, old, position)
+                if packet is None:
+                    continue
+                self.positions[user_id] = position
+                players[user_id].world.grid.move(user_id, position[0] // 32, position[2] // 32)
+                moved.append((user_id, packet))
+        finally:
+            # A move that fails must not come back on every following tick
+            self.pending_moves.clear()
+
+        # Update interest sets only once every position is current
+        fresh = set()
+        for user_id, packet in moved:
+            conn = players[user_id]
+            if conn.ready:
+                self.update_interest(conn, fresh)
+                if conn.deferred:
+                    self.send_deferred_blocks(conn)
+
+        for user_id, packet in moved:
+            absolute = extended = None
+            for other in players[user_id].visible:  # Clients move themselves, no echo
+                if (other, user_id) not in fresh:
+                    other_conn = players[other]
+                    if "ExtEntityPositions" in other_conn.extensions:
+                        if extended is None:
+                            extended = Packets.teleport_packet(user_id, self.positions[user_id], True)
+                        other_conn.send_move(user_id, extended if packet[0] == 0x08 else packet, extended)
+                        continue
+                    if absolute is None:
+                        absolute = Packets.teleport_packet(user_id, self.positions[user_id])
+                    other_conn.send_move(user_id, packet, absolute)
+
+    async def tick_periodically(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / tick_rate
+        next_tick = loop.time()
+        while True:
+            next_tick = max(next_tick + interval, loop.time())  # Skip ticks rather than bursting after a stall
+            await asyncio.sleep(next_tick - loop.time())
             try:
-                writer.write(b'\x08' + struct.pack('b', user_id) + struct.pack('>h', x) + struct.pack('>h', y) + struct.pack('>h', z) + struct.pack('B', yaw) + struct.pack('B', pitch))
+                with tick_seconds.time():
+                    self.tick()
             except Exception as e:
-                print(f"Error moving player: {e}")
-                raise
+                log.error("Error in tick: %s", e)
+
+    def send_error(self, message):
+        self.chat.append(b'\x0d' + struct.pack('>b', 0) + self.format_string(message))
+        self.send_chat()
+
+    def handle_login(self, conn, packet):
+        if not packet.cpe:
+            return self.finish_login(conn, packet)
+        # Offer our extensions, the login finishes once the client listed its own
+        conn.login = packet
+        conn.writer.write(Packets.ext_info_packets("MCSnake", EXTENSIONS))
+
+    def handle_ext_info(self, conn, packet):
+        if conn.login is None or conn.ext_remaining is not None:
+            return
+        conn.ext_remaining = packet.extension_count
+        if conn.ext_remaining <= 0:
+            return self.finish_negotiation(conn)
+
+    def handle_ext_entry(self, conn, packet):
+        if conn.login is None or conn.ext_remaining is None:
+            return
+        if EXTENSIONS.get(packet.name) == packet.version:
+            conn.extensions.add(packet.name)
+        conn.ext_remaining -= 1
+        if conn.ext_remaining <= 0:
+            return self.finish_negotiation(conn)
+
+    def finish_negotiation(self, conn):
+        packet = conn.login
+        conn.login = None
+        if "ExtEntityPositions" in conn.extensions:
+            conn.client_packets = Packets.EXT_POSITION_CLIENT_PACKETS
+        log.info("%s uses extensions: %s", packet.username, ", ".join(sorted(conn.extensions)) or "none")
+        return self.finish_login(conn, packet)
+
+    async def finish_login(self, conn, packet):
+        # Send server info
+        conn.writer.write(b'\x00\x07' + self.format_string(name) + self.format_string(motd) + b'\x64')
+
+        # Create user
+        id = self.ids
+        self.ids += 1
+        conn.user = {"id": id, "username": packet.username}
+        self.users.append(conn.user)
+        self.players[id] = conn
+        
+        self.enter_world(conn, self.hub)
+
+        # Stream the map straight to the socket, anything broadcast meanwhile stays queued until it is done
+        log.debug("Preparing map data for %s", packet.username)
+        await self.send_map(conn, self.hub)
+
+        conn.start_sender()
+        self.send_players(conn)
+        if self.plugins.on_join:
+            self.plugins.dispatch(self.plugins.on_join, conn)
+
+    def handle_message(self, conn, packet):
+        if self.plugins.on_chat and not self.plugins.dispatch(self.plugins.on_chat, conn, packet.message):
+            return
+        if packet.message.startswith('/'):
+            return self.handle_command(conn, packet.message[1:].split())
+
+        # Split message into chunks of 64 characters, accounting for "> " prefix
+        user = conn.user
+        message = f"{user['username']}: {packet.message}"
+        first_chunk = message[:64]
+        remaining = message[64:]
+        chunks = [remaining[i:i+62] for i in range(0, len(remaining), 62)]  # 62 to account for "> "
+        
+        self.chat.append(b'\x0d' + struct.pack('>b', user["id"]) + self.format_string(first_chunk))
+        for chunk in chunks:
+            self.chat.append(b'\x0d' + struct.pack('>b', user["id"]) + self.format_string("> " + chunk))
+        self.send_chat()
+
+    def handle_command(self, conn, args):
+        if len(args) == 2 and args[0] == "goto":
+            return self.change_world(conn, args[1])
+        if args == ["worlds"]:
+            self.send_message(conn, "Worlds: " + ", ".join(sorted(self.worlds)))
+        elif args == ["plugins"]:
+            # Where the tick budget goes, slowest handlers first
+            for plugin_name, event, calls, seconds in self.plugins.timings():
+                self.send_message(conn, f"{plugin_name} {event}: {calls} calls, {seconds * 1000:.1f} ms")
+        else:
+            self.send_message(conn, "Commands: /worlds, /goto <world>, /plugins")
+
+    def handle_set_block(self, conn, packet):
+        if not conn.ready:
+            return  # Placed in the world the player is leaving
+        block_id = packet.block_id if packet.mode == 0x01 else 0
+        if self.plugins.on_block_change and not self.plugins.dispatch(self.plugins.on_block_change, conn, packet.x, packet.y, packet.z, block_id):
+            # Cancelled, the client already shows its change so put the old block back
+            level = conn.world.level
+            if level.in_bounds(packet.x, packet.y, packet.z):
+                conn.send(Packets.BLOCK_CHANGE.pack(0x06, packet.x, packet.y, packet.z, level.get_block(packet.x, packet.y, packet.z)))
+            return
+        # Update block and send to the players in the same world
+        self.block_update(packet.x, packet.y, packet.z, block_id, conn.user["username"], conn.world)
+
+    def handle_position(self, conn, packet):
+        if not conn.ready:
+            return  # Still at the coordinates of the world the player is leaving
+        if self.plugins.on_move:
+            self.plugins.dispatch(self.plugins.on_move, conn, packet.x, packet.y, packet.z, packet.yaw, packet.pitch)
+        self.move_player(conn.user["id"], packet.x, packet.y, packet.z, packet.yaw, packet.pitch)
 
     async def handle_client(self, reader, writer):
-        client = writer.get_extra_info('peername')
+        conn = Connection(reader, writer)
+        conn.resend_map = self.resend_map
+        client = conn.address
         self.clients.add(client)
-        self.writers.add(writer)
-        print(f"New connection from {client}")
+        self.connections.add(conn)
+        log.info("New connection from %s", client)
         self.player_count += 1
         
-        to_send = []
-        user = None
+        handlers = self.handlers
 
         try:
-            while True:
-                header = await reader.read(1)
-                if not header:
-                    break
-                
-                packet_id = struct.unpack('>B', header)[0]
-                
-                # Determine packet length based on packet ID
-                if packet_id == 0x00:
-                    packet_length = 130  # Example: Handshake packet
-                elif packet_id == 0x0d:
-                    packet_length = 65   # Example: Chat message packet
-                elif packet_id == 0x05:
-                    packet_length = 8    # Example: Block update packet
-                elif packet_id == 0x08:
-                    packet_length = 9    # Example: Player position packet
-                else:
-                    print(f"Unknown packet ID: {packet_id}")
-                    break
-                
-                packet_data = header + await reader.read(packet_length)
-
-                # print(f"Raw packet: {packet_data!r}")
-                decoded = self.decode_packet(packet_data)
-                # print(f"Decoded packet: {decoded}")
-                
-                if decoded is None:
-                    self.chat.append(b'\x0d' + struct.pack('>b', 0) + self.format_string("Error: unknown packet"))
-                    print(packet_data)
-                    self.send_chat()
-                else:
-                    if decoded['packet'] == 0x00:
-                        # Send server info
-                        to_send.append(b'\x00\x07' + self.format_string(name) + self.format_string(motd) + b'\x64')
-
-                        # Create user
-                        id = self.ids
-                        self.ids += 1
-                        user = {"id": id, "username": decoded['username']}
-                        self.users.append(user)
-                        
-                        self.create_player(id, decoded['username'])
-
-                        # Prepare and send map data
-                        print("Preparing map data...")
-                        to_send = self.send_map(to_send)
-
-                        self.send_players(to_send, user)
-                        
-                    elif decoded['packet'] == 0x0d and user is not None:
-                        # Split message into chunks of 64 characters, accounting for "> " prefix
-                        message = f"{user['username']}: {decoded['message']}"
-                        first_chunk = message[:64]
-                        remaining = message[64:]
-                        chunks = [remaining[i:i+62] for i in range(0, len(remaining), 62)]  # 62 to account for "> "
-                        
-                        self.chat.append(b'\x0d' + struct.pack('>b', user["id"]) + self.format_string(first_chunk))
-                        for chunk in chunks:
-                            self.chat.append(b'\x0d' + struct.pack('>b', user["id"]) + self.format_string("> " + chunk))
-                        self.send_chat()
-                    elif decoded['packet'] == 0x05 and user is not None:
-                        # Update block and send to all clients
-                        x = decoded['x']
-                        y = decoded['y']
-                        z = decoded['z']
-                        block_id = decoded['block_id'] if decoded['mode'] == 0x01 else 0
-                        
-                        self.block_update(x, y, z, block_id)
-                    elif decoded['packet'] == 0x08 and user is not None:
-                        self.move_player(user["id"], decoded['x'], decoded['y'], decoded['z'], decoded['yaw'], decoded['pitch'])
-                    else:
-                        self.chat.append(b'\x0d' + struct.pack('>b', 0) + self.format_string('Error: unknown packet'))
-                        print(packet_data)
-                        self.send_chat()
-
-                # Send all queued packets
-                for response in to_send:
-                    try:
-                        writer.write(response)
-                        await writer.drain()
-                    except Exception as e:
-                        print(f"Error sending packet: {e}")
-                        raise
-                        
-                to_send.clear()
+            async for packets in Packets.read_packets(reader, client=conn):
+                for packet in packets:
+                    packets_in.inc(packet.ID)
+                    if conn.user is None and packet.ID not in LOGIN_PACKETS:
+                        self.send_error('Error: unknown packet')
+                        continue
+                    result = handlers[packet.ID](conn, packet)
+                    if result is not None:
+                        await result
                 
         except Exception as e:
-            print(f"Error handling client {client}: {e}")
+            log.error("Error handling client %s: %s", client, e)
         finally:
+            conn.closed = True
+            if conn.sender is not None:
+                conn.sender.cancel()
             writer.close()
             try:
                 await writer.wait_closed()
             except Exception as e:
-                print(f"Error closing connection: {e}")
+                log.debug("Error closing connection: %s", e)
             if client in self.clients:
                 self.clients.remove(client)
-                self.writers.remove(writer)
-            print(f"Connection closed for {client}")
-            self.level.save_level("main.lvl")
+            self.connections.discard(conn)
+            log.info("Connection closed for %s", client)
             self.player_count -= 1
-            self.delete_player(user["id"])
-            self.users.remove(user)
+            if conn.user is not None:
+                self.delete_player(conn.user["id"])
+                self.users.remove(conn.user)
 
 
     async def start(self):
+        self.plugins.load(asyncio.get_running_loop())
+        await self.encode_pool.warm_up()
+
         # Create heartbeat task when server starts
         if self.public:
             self.heartbeat_task = asyncio.create_task(self.broadcast_online_periodically())
         
+        reuse_port = network_processes > 0
+        if reuse_port and not Relay.reuse_port_supported():
+            log.warning("SO_REUSEPORT is not available, running a single networking process")
+            reuse_port = False
         server = await asyncio.start_server(
-            self.handle_client, self.host, self.port
+            self.handle_client, self.host, self.port, reuse_port=reuse_port or None
         )
-        print(f"Server listening on {self.host}:{self.port}")
+        log.info("Server listening on %s:%s", self.host, self.port)
+        if reuse_port:
+            # Gateways accept on the same port and relay their clients here, where the worlds live
+            relay = await Relay.RelayServer(self.handle_client).start()
+            self.gateways = Relay.start_gateways(network_processes, self.host, self.port, relay.port,
+                                                 send_queue_limit * 4, log_level, log_format)
         
-        async with server:
-            await server.serve_forever()
+        self.autosave_task = asyncio.create_task(self.autosave_periodically())
+        self.tick_task = asyncio.create_task(self.tick_periodically())
+        self.lag_task = asyncio.create_task(Metrics.watch_loop_lag(loop_lag, loop_lag_seconds))
+        if metrics_port:
+            await Metrics.Endpoint(metrics, self.profiler).start('127.0.0.1', metrics_port)
+        for world in self.loaded.values():
+            self.start_journal(world)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Final save on shutdown
+            self.autosave_task.cancel()
+            self.tick_task.cancel()
+            self.lag_task.cancel()
+            self.plugins.shutdown()
+            self.encode_pool.shutdown()
+            for process in self.gateways:
+                process.terminate()
+            for world in self.loaded.values():
+                world.journal.flush_task.cancel()
+            await self.save_level()
 
 def load_property(filename, property_name, default):
     """Load a property from a file"""
     with open(filename, 'r') as f:
         for line in f:
             if line.startswith(property_name):
-                return line.split('=')[1].strip()
+                return line.split('=', 1)[1].strip()
     return default
 
 name = load_property("server.properties", "name", "MCSnake Default Name")
 motd = load_property("server.properties", "motd", "MCSnake, a python project.")
 public = load_property("server.properties", "public", "false").lower() == "true"
+heartbeat_url = load_property("server.properties", "heartbeat-url", "http://www.classicube.net/server/heartbeat/")
+heartbeat_interval = float(load_property("server.properties", "heartbeat-interval", 120))  # Seconds between heartbeats
+autosave_interval = float(load_property("server.properties", "autosave", 60))  # Seconds between background saves
+send_queue_limit = int(load_property("server.properties", "send-queue-limit", 262144))  # Bytes queued per client before it counts as slow
+slow_client_timeout = float(load_property("server.properties", "slow-client-timeout", 10))  # Seconds a client may stay over the limit
+tick_rate = float(load_property("server.properties", "tick-rate", 20))  # Movement broadcasts per second
+generator = load_property("server.properties", "generator", "flat")  # Used when main.lvl does not exist yet
+seed = int(load_property("server.properties", "seed", "") or int.from_bytes(os.urandom(4), 'big'))
+edit_batch_limit = int(load_property("server.properties", "edit-batch-limit", 4096))  # Larger edits resend the map instead of block changes
+journal_flush_interval = float(load_property("server.properties", "journal-flush", 1))  # Seconds between journal fsyncs
+world_names = [world_name.strip() for world_name in load_property("server.properties", "worlds", "").split(',') if world_name.strip()]  # Created in worlds/ on first visit
+max_loaded_worlds = int(load_property("server.properties", "max-loaded-worlds", 4))  # Empty worlds are unloaded early above this
+world_idle_timeout = float(load_property("server.properties", "world-idle-timeout", 300))  # Seconds a world may stay loaded while empty
+plugin_threads = int(load_property("server.properties", "plugin-threads", 4))  # Threads for hooks marked @Plugins.threaded
+metrics_port = int(load_property("server.properties", "metrics-port", 0))  # Local HTTP port for /metrics and /profile, 0 = off
+encode_workers = int(load_property("server.properties", "encode-workers", 2))  # Processes compressing maps, 0 = a thread instead
+network_processes = int(load_property("server.properties", "network-processes", 0))  # Extra processes accepting clients on the port, 0 = off
+log_level = load_property("server.properties", "log-level", "INFO")
+log_format = load_property("server.properties", "log-format", "text")  # text or json
+view_distance = int(load_property("server.properties", "view-distance", 0))  # Blocks, players further apart don't see each other, 0 = unlimited
 
 if __name__ == "__main__":
+    Log.setup(log_level, log_format)
     server = MCSnake(load_property("server.properties", "host", '127.0.0.1'), load_property("server.properties", "port", 25565))
-    asyncio.run(server.start())
\ No newline at end of file
+    try:
+        asyncio.run(server.start())
+    except KeyboardInterrupt:
+        log.info("Server stopped")
\ No newline at end of file